@@ -0,0 +1,97 @@
+"""Compare the bulk PDB reader against the former line-by-line loader."""
+import argparse
+import random
+import tempfile
+import timeit
+from pathlib import Path
+
+from haddock2mmcif.modules.pdb import PDB
+
+from synthetic import ATOM_LINE
+
+
+def write_pdb(pdb_f, n_atoms):
+    """Write a synthetic PDB with `n_atoms`, split into chains of <9999 residues."""
+    atoms = [("N", "N"), ("CA", "C"), ("C", "C"), ("O", "O"), ("CB", "C")]
+    chains = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    n_chains = max(2, -(-n_atoms // 40000))
+    per_chain = n_atoms // n_chains
+    with open(pdb_f, "w") as fh:
+        for chain in chains[:n_chains]:
+            for i in range(per_chain):
+                atom, element = atoms[i % len(atoms)]
+                fh.write(
+                    ATOM_LINE.format(
+                        serial=i % 100000,
+                        atom=atom,
+                        resname="ALA",
+                        chain=chain,
+                        resnum=i // len(atoms) + 1,
+                        x=random.uniform(-99, 99),
+                        y=random.uniform(-99, 99),
+                        z=random.uniform(-99, 99),
+                        element=element,
+                    )
+                )
+            fh.write("TER\n")
+        fh.write("END\n")
+
+
+def legacy_load(pdb_f):
+    """Load the atoms line by line, as PDB.load did before, for reference."""
+    pdb_dic = {}
+    map_dic = {}
+    atom_list = []
+    seq_id = 0
+    with open(pdb_f) as fh:
+        for line in fh.readlines():
+            if line.startswith("ATOM"):
+                atom_id = line[12:16].strip()
+                chain = line[21]
+                resname = line[17:20]
+                resnum = int(line[22:26])
+                x = float(line[30:38])
+                y = float(line[38:46])
+                z = float(line[46:54])
+                element = line[77:79].strip()
+                if chain not in pdb_dic:
+                    pdb_dic[chain] = {}
+                    map_dic[chain] = {}
+                    seq_id = 0
+
+                if resnum not in pdb_dic[chain]:
+                    pdb_dic[chain][resnum] = resname
+                    seq_id += 1
+                    map_dic[chain][seq_id] = resnum
+
+                atom_list.append((chain, seq_id, element, atom_id, x, y, z))
+    return atom_list
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--atoms", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'atoms':>8s} {'legacy':>10s} {'read':>10s} {'speedup':>8s}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for n_atoms in args.atoms:
+            pdb_f = Path(tmpdir, f"bench_{n_atoms}.pdb")
+            write_pdb(pdb_f, n_atoms)
+
+            legacy = min(
+                timeit.repeat(
+                    lambda pdb_f=pdb_f: legacy_load(pdb_f), number=1, repeat=args.repeat
+                )
+            )
+            read = min(
+                timeit.repeat(
+                    lambda pdb_f=pdb_f: PDB(pdb_f).load(), number=1, repeat=args.repeat
+                )
+            )
+            print(f"{n_atoms:8d} {legacy:9.4f}s {read:9.4f}s {legacy / read:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Time each stage of the conversion on synthetic run directories."""
+import argparse
+import json
+import logging
+import tempfile
+from pathlib import Path
+
+from haddock2mmcif import converter
+
+from synthetic import make_run
+
+STAGES = [
+    "parameters",
+    "entities",
+    "ranking",
+    "models",
+    "model groups",
+    "ambiguous restraints",
+    "unambiguous restraints",
+    "dump",
+]
+
+
+def run_pipeline(rundir, output_fname, **kwargs):
+    """Convert a run directory, returning the wall time of each stage.
+
+    The stages are timed by the profiler of the conversion itself.
+    """
+    converter.convert_rundir(rundir, output_fname, profile=True, **kwargs)
+    with open(Path(output_fname).with_suffix(".profile.json"), "r") as fh:
+        report = json.load(fh)
+    return {stage["stage"]: stage["wall_time"] for stage in report["stages"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chains", type=int, default=2)
+    parser.add_argument(
+        "--atoms", type=int, nargs="+", default=[2000, 10000], help="Atoms per model"
+    )
+    parser.add_argument("--clusters", type=int, default=4)
+    parser.add_argument("--models-per-cluster", type=int, default=4)
+    parser.add_argument("--ambig", type=int, default=100, help="Ambiguous restraints")
+    parser.add_argument(
+        "--unambig", type=int, default=10, help="Unambiguous restraints"
+    )
+    parser.add_argument("--json", type=str, help="Also write the timings to this file")
+    args = parser.parse_args()
+
+    # the progress messages would drown the table
+    logging.getLogger("log").setLevel(logging.WARNING)
+
+    result_list = []
+    widths = [max(len(stage), 12) for stage in STAGES]
+    print(
+        f"{'atoms':>8s} "
+        + " ".join(f"{stage:>{width}s}" for stage, width in zip(STAGES, widths))
+    )
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for n_atoms in args.atoms:
+            rundir = make_run(
+                Path(tmpdir, f"run_{n_atoms}"),
+                n_chains=args.chains,
+                atoms_per_model=n_atoms,
+                n_clusters=args.clusters,
+                models_per_cluster=args.models_per_cluster,
+                n_ambig=args.ambig,
+                n_unambig=args.unambig,
+            )
+            time_dic = run_pipeline(rundir, Path(tmpdir, f"run_{n_atoms}.cif"))
+            print(
+                f"{n_atoms:8d} "
+                + " ".join(
+                    f"{time_dic[stage]:{width - 1}.4f}s"
+                    for stage, width in zip(STAGES, widths)
+                )
+            )
+            result_list.append({"atoms": n_atoms, **time_dic})
+
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(result_list, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Compare the streaming restraint parser against the former regex loaders."""
+import argparse
+import re
+import tempfile
+import timeit
+from pathlib import Path
+
+import numpy as np
+
+from haddock2mmcif.modules.restraints import AmbigRestraint, UnambigRestraint
+
+from synthetic import build_template, write_ambig, write_unambig
+
+
+def legacy_ambig(tbl_f):
+    """Load the ambig restraints line by line, as AmbigRestraint.load did before."""
+    tbl_dic = {}
+    tbl_regex = r"resid\s*(\d*).*segid\s*(\w*)"
+    with open(tbl_f, "r") as fh:
+        for line in fh.readlines():
+            if line.startswith("assign"):
+                match = re.search(tbl_regex, line)
+                active = (int(match.group(1)), str(match.group(2)))
+                tbl_dic[active] = []
+            else:
+                match = re.search(tbl_regex, line)
+                if match:
+                    tbl_dic[active].append((int(match.group(1)), str(match.group(2))))
+    return tbl_dic
+
+
+def legacy_unambig(tbl_f):
+    """Load the unambig restraints line by line, as UnambigRestraint.load did before."""
+    tbl_list = []
+    resid_regex = r"resid\s(\d*)"
+    segid_regex = r"segid\s*(\w*)"
+    distances_regex = r"(\d*.?\d*)\s(\d*.?\d*)\s(\d*.?\d*)$"
+    with open(tbl_f, "r") as fh:
+        for line in fh.readlines():
+            if line.startswith("assign"):
+                res_i, res_j = re.findall(resid_regex, line)
+                segid_i, segid_j = re.findall(segid_regex, line)
+                distance, lower, upper = re.findall(distances_regex, line)[0]
+                tbl_list.append(
+                    (
+                        int(res_i),
+                        segid_i,
+                        int(res_j),
+                        segid_j,
+                        float(distance),
+                        float(lower),
+                        float(upper),
+                    )
+                )
+    return tbl_list
+
+
+def load(restraint_class, tbl_f):
+    restraint = restraint_class(tbl_f)
+    restraint.load()
+    return restraint
+
+
+def count_lines(tbl_f):
+    with open(tbl_f, "rb") as fh:
+        return sum(1 for _ in fh)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--restraints", type=int, nargs="+", default=[1000, 10000, 100000]
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    chain_list = build_template(2, 5000)
+    print(
+        f"{'table':>8s} {'lines':>8s} {'legacy':>10s} {'stream':>10s} {'speedup':>8s}"
+    )
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for n_restraints in args.restraints:
+            rng = np.random.default_rng(0)
+            ambig_f = Path(tmpdir, f"ambig_{n_restraints}.tbl")
+            unambig_f = Path(tmpdir, f"unambig_{n_restraints}.tbl")
+            write_ambig(ambig_f, chain_list, n_restraints, rng=rng)
+            write_unambig(unambig_f, chain_list, n_restraints, rng=rng)
+
+            cases = [
+                ("ambig", ambig_f, legacy_ambig, AmbigRestraint),
+                ("unambig", unambig_f, legacy_unambig, UnambigRestraint),
+            ]
+            for name, tbl_f, legacy_load, restraint_class in cases:
+                legacy = min(
+                    timeit.repeat(
+                        lambda legacy_load=legacy_load, tbl_f=tbl_f: legacy_load(tbl_f),
+                        number=1,
+                        repeat=args.repeat,
+                    )
+                )
+                stream = min(
+                    timeit.repeat(
+                        lambda restraint_class=restraint_class, tbl_f=tbl_f: load(
+                            restraint_class, tbl_f
+                        ),
+                        number=1,
+                        repeat=args.repeat,
+                    )
+                )
+                print(
+                    f"{name:>8s} {count_lines(tbl_f):8d} {legacy:9.4f}s "
+                    f"{stream:9.4f}s {legacy / stream:7.1f}x"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Time the sharded dump against the plain one, and check their outputs match.
+
+The shards are merged by splicing their atoms into the output of `ihm`, this
+relies on how `ihm` writes the atoms, run this before adding a version of it
+to `IHM_VERSIONS` in `haddock2mmcif.modules.shards` and to setup.py.
+"""
+import argparse
+import filecmp
+import logging
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from haddock2mmcif import converter
+
+from synthetic import make_run
+
+
+def time_convert(rundir, output_fname, **kwargs):
+    start = time.perf_counter()
+    converter.convert_rundir(rundir, output_fname, **kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chains", type=int, default=2)
+    parser.add_argument(
+        "--atoms", type=int, nargs="+", default=[2000, 10000], help="Atoms per model"
+    )
+    parser.add_argument("--clusters", type=int, default=4)
+    parser.add_argument("--models-per-cluster", type=int, default=4)
+    parser.add_argument("--jobs", type=int, default=4)
+    args = parser.parse_args()
+
+    # the progress messages would drown the table
+    logging.getLogger("log").setLevel(logging.WARNING)
+
+    failed = False
+    print(f"{'atoms':>8s} {'plain':>10s} {'sharded':>10s} {'output':>8s}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for n_atoms in args.atoms:
+            rundir = make_run(
+                Path(tmpdir, f"run_{n_atoms}"),
+                n_chains=args.chains,
+                atoms_per_model=n_atoms,
+                n_clusters=args.clusters,
+                models_per_cluster=args.models_per_cluster,
+            )
+            plain_f = Path(tmpdir, f"plain_{n_atoms}.cif")
+            sharded_f = Path(tmpdir, f"sharded_{n_atoms}.cif")
+            plain = time_convert(rundir, plain_f, evaluate_restraints=True)
+            sharded = time_convert(
+                rundir,
+                sharded_f,
+                evaluate_restraints=True,
+                shards=True,
+                jobs=args.jobs,
+            )
+
+            same = filecmp.cmp(plain_f, sharded_f, shallow=False)
+            failed = failed or not same
+            print(
+                f"{n_atoms:8d} {plain:9.4f}s {sharded:9.4f}s "
+                f"{'same' if same else 'DIFFERS':>8s}"
+            )
+
+    if failed:
+        sys.exit("The sharded output differs from the plain one")
+
+
+if __name__ == "__main__":
+    main()
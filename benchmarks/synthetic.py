@@ -0,0 +1,202 @@
+"""Generate synthetic HADDOCK run directories of scalable size."""
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+ATOM_LINE = (
+    "ATOM  {serial:5d} {atom:<4s} {resname:3s} {chain:1s}{resnum:4d}    "
+    "{x:8.3f}{y:8.3f}{z:8.3f}  1.00  0.00      {chain:<4s}{element:>2s}\n"
+)
+
+# A residue is represented by its backbone and CB, placed around its lattice point
+RESIDUE_ATOMS = [
+    ("N", "N", (-1.2, 0.4, 0.0)),
+    ("CA", "C", (0.0, 0.0, 0.0)),
+    ("C", "C", (1.2, 0.5, 0.0)),
+    ("O", "O", (1.5, 1.6, 0.3)),
+    ("CB", "C", (0.0, -1.0, 1.2)),
+]
+RESNAMES = ["ALA", "LEU", "SER", "LYS", "GLU", "VAL", "THR", "ASP"]
+CHAINS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+SPACING = 3.8
+
+
+def build_template(n_chains, atoms_per_model, seed=0):
+    """Build the chains of a complex as blocks of residues on a lattice.
+
+    The blocks are stacked along x, each touching the next one, so every pair
+    of consecutive chains has an interface.
+    """
+    rng = np.random.default_rng(seed)
+    n_residues = max(1, atoms_per_model // (n_chains * len(RESIDUE_ATOMS)))
+    if n_residues > 9999:
+        raise ValueError("Too many residues per chain, use more chains")
+
+    side = int(np.ceil(n_residues ** (1 / 3)))
+    grid = np.array(
+        [(i, j, k) for i in range(side) for j in range(side) for k in range(side)]
+    )[:n_residues]
+    offsets = np.array([offset for _, _, offset in RESIDUE_ATOMS])
+
+    chain_list = []
+    for chain_idx in range(n_chains):
+        centers = grid * SPACING
+        centers[:, 0] += chain_idx * side * SPACING
+        coords = centers[:, None, :] + offsets[None, :, :]
+        resnames = rng.choice(RESNAMES, size=n_residues)
+        chain_list.append((CHAINS[chain_idx], resnames, coords))
+    return chain_list
+
+
+def write_model(pdb_f, chain_list, jitter=0.0, rng=None):
+    """Write the chains to a PDB, displacing each atom by up to `jitter`."""
+    serial = 1
+    with open(pdb_f, "w") as fh:
+        for chain, resnames, coords in chain_list:
+            if jitter:
+                coords = coords + rng.uniform(-jitter, jitter, size=coords.shape)
+            for resnum, (resname, residue) in enumerate(zip(resnames, coords)):
+                for (atom, element, _), (x, y, z) in zip(RESIDUE_ATOMS, residue):
+                    fh.write(
+                        ATOM_LINE.format(
+                            serial=serial % 100000,
+                            atom=atom,
+                            resname=resname,
+                            chain=chain,
+                            resnum=resnum + 1,
+                            x=x,
+                            y=y,
+                            z=z,
+                            element=element,
+                        )
+                    )
+                    serial += 1
+            fh.write("TER\n")
+        fh.write("END\n")
+
+
+def write_ambig(tbl_f, chain_list, n_restraints, n_passive=5, rng=None):
+    """Write `n_restraints` ambiguous restraints between consecutive chains."""
+    with open(tbl_f, "w") as fh:
+        for i in range(n_restraints):
+            idx = i % max(1, len(chain_list) - 1)
+            active_chain, active_res, _ = chain_list[idx]
+            passive_chain, passive_res, _ = chain_list[(idx + 1) % len(chain_list)]
+            active = rng.integers(1, len(active_res) + 1)
+            passive_list = rng.integers(1, len(passive_res) + 1, size=n_passive)
+            fh.write(f"assign ( resid {active} and segid {active_chain})\n")
+            fh.write("       (\n")
+            fh.write(
+                "     or\n".join(
+                    f"        ( resid {passive} and segid {passive_chain})\n"
+                    for passive in passive_list
+                )
+            )
+            fh.write("       )  2.0 2.0 0.0\n")
+
+
+def write_unambig(tbl_f, chain_list, n_restraints, rng=None):
+    """Write `n_restraints` unambiguous restraints between consecutive chains."""
+    with open(tbl_f, "w") as fh:
+        for i in range(n_restraints):
+            idx = i % max(1, len(chain_list) - 1)
+            chain_i, res_i, _ = chain_list[idx]
+            chain_j, res_j, _ = chain_list[(idx + 1) % len(chain_list)]
+            fh.write(
+                f"assign (resid {rng.integers(1, len(res_i) + 1)} and segid {chain_i}) "
+                f"(resid {rng.integers(1, len(res_j) + 1)} and segid {chain_j}) "
+                "5.0 2.0 2.0\n"
+            )
+
+
+def make_run(
+    rundir,
+    n_chains=2,
+    atoms_per_model=2000,
+    n_clusters=4,
+    models_per_cluster=4,
+    n_ambig=100,
+    n_unambig=10,
+    seed=0,
+):
+    """Create a synthetic run directory with the files haddock2mmcif reads."""
+    rundir = Path(rundir)
+    rng = np.random.default_rng(seed)
+    chain_list = build_template(n_chains, atoms_per_model, seed=seed)
+
+    begin_dir = Path(rundir, "begin")
+    begin_dir.mkdir(parents=True, exist_ok=True)
+    write_model(Path(begin_dir, "complex_1.pdb"), chain_list)
+
+    # water refined models, clustered in consecutive blocks
+    n_models = max(n_clusters * models_per_cluster * 2, 20)
+    water_dir = Path(rundir, "structures", "it1", "water")
+    Path(water_dir, "analysis").mkdir(parents=True, exist_ok=True)
+    with open(Path(water_dir, "file.list"), "w") as fh:
+        for model in range(n_models + 1):
+            score = rng.uniform(-150, -50)
+            fh.write(f'"PREVIT:complex_{model + 1}w.pdb"  {{ {score:.5f} }}\n')
+
+    per_cluster = n_models // n_clusters
+    with open(Path(water_dir, "analysis", "cluster.out"), "w") as fh:
+        for cluster in range(n_clusters):
+            members = range(cluster * per_cluster + 1, (cluster + 1) * per_cluster + 1)
+            fh.write(
+                f"Cluster {cluster + 1} -> {members[0]} "
+                f"{' '.join(str(e) for e in members)} \n"
+            )
+
+    for cluster in range(n_clusters):
+        for model in range(models_per_cluster):
+            write_model(
+                Path(rundir, f"cluster{cluster + 1}_{model + 1}.pdb"),
+                chain_list,
+                jitter=0.5,
+                rng=rng,
+            )
+
+    restraint_dir = Path(rundir, "data", "distances")
+    restraint_dir.mkdir(parents=True, exist_ok=True)
+    write_ambig(Path(restraint_dir, "ambig.tbl"), chain_list, n_ambig, rng=rng)
+    write_unambig(Path(restraint_dir, "unambig.tbl"), chain_list, n_unambig, rng=rng)
+
+    with open(Path(rundir, "run.cns"), "w") as fh:
+        fh.write("{===>} noecv=true;\n")
+        fh.write("{===>} ncvpart=2;\n")
+        fh.write("{===>} flcut=5.0;\n")
+        for stage, weights in enumerate([(0.01, 1.0), (1.0, 1.0), (1.0, 0.2)]):
+            fh.write(f"{{===>}} w_vdw_{stage}={weights[0]};\n")
+            fh.write(f"{{===>}} w_elec_{stage}={weights[1]};\n")
+
+    return rundir
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("rundir", type=str)
+    parser.add_argument("--chains", type=int, default=2)
+    parser.add_argument("--atoms", type=int, default=2000, help="Atoms per model")
+    parser.add_argument("--clusters", type=int, default=4)
+    parser.add_argument("--models-per-cluster", type=int, default=4)
+    parser.add_argument("--ambig", type=int, default=100, help="Ambiguous restraints")
+    parser.add_argument(
+        "--unambig", type=int, default=10, help="Unambiguous restraints"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    make_run(
+        args.rundir,
+        n_chains=args.chains,
+        atoms_per_model=args.atoms,
+        n_clusters=args.clusters,
+        models_per_cluster=args.models_per_cluster,
+        n_ambig=args.ambig,
+        n_unambig=args.unambig,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -12,7 +12,8 @@ setup(
     package_dir={"": "src"},
     classifiers=[],
     python_requires=">=3.9, <4",
-    install_requires=["ihm"],
+    install_requires=["ihm>=0.35,<0.36", "numpy"],
+    extras_require={"bcif": ["msgpack"]},
     entry_points={
         "console_scripts": [
             "haddock2mmcif=haddock2mmcif.cli:main",
@@ -1,22 +1,22 @@
 import argparse
-import itertools
 import logging
-import re
+import os
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-import ihm
-import ihm.dataset
-import ihm.dumper
-import ihm.location
-import ihm.model
-import ihm.protocol
-import ihm.representation
-import ihm.restraint
-
-from haddock2mmcif.modules.docking import DockingModel
-from haddock2mmcif.modules.pdb import PDB
-from haddock2mmcif.modules.restraints import AmbigRestraint, UnambigRestraint
-from haddock2mmcif.modules.utils import backmap
+# IMPORTANT: `ihm` takes a while to import and is not needed to check the runs,
+#  the conversion (`haddock2mmcif.converter`) is only imported to convert them
+from haddock2mmcif.modules.archive import RunArchive, get_run_name, is_archive
+from haddock2mmcif.modules.metrics import parse_metric
+from haddock2mmcif.modules.output import (
+    COMPRESSION_EXTENSIONS,
+    FORMAT_EXTENSIONS,
+    get_output_extension,
+    parse_output_name,
+)
+from haddock2mmcif.modules.runindex import RunIndex
 
 log = logging.getLogger("log")
 log.setLevel(logging.INFO)
@@ -27,363 +27,298 @@ formatter = logging.Formatter(
 ch.setFormatter(formatter)
 log.addHandler(ch)
 
-PARAM_REGEX = r"{===>}\s(\w+)=(\d.*);"
-
-
-def rank_clusters(cluster_out: Path, file_list: Path) -> dict[int, int]:
-    """Rank the clusters based on their combined score."""
-    score_dic = {}
-    score_regex = r"{\s(-?\d*.?\d*)\s}"
-    with open(file_list, "r") as f_fh:
-        for model_idx, line in enumerate(f_fh.readlines()):
-            match = re.search(score_regex, line)
-            if match:
-                score = float(match.group(1))
-                score_dic[model_idx] = score
-
-    clt_dic = {}
-    cluster_line_regex = r"Cluster\s(\d+)\s->\s\d+\s(.*)"
-    with open(cluster_out, "r") as c_fh:
-        for line in c_fh.readlines():
-            match = re.search(cluster_line_regex, line)
-            if match:
-                cluster_name = int(match.group(1))
-                cluster_elements = match.group(2).split()
-                cluster_elements = map(int, cluster_elements)
-
-                cluster_elements = list(cluster_elements)
-                top4 = cluster_elements[:4]
-
-                # avg_total = (sum(score_dic[e] for e in cluster_elements) /
-                #              len(cluster_elements))
-
-                avg_top4 = sum(score_dic[e] for e in top4) / len(top4)
-
-                clt_dic[cluster_name] = avg_top4
-
-    ranking_dic = {}
-    for ranking, cluster_name in enumerate(sorted(clt_dic, key=clt_dic.get)):  # type: ignore
-        ranking_dic[ranking + 1] = cluster_name
-
-    return ranking_dic
-
-
-def get_final_models(path: Path) -> dict[int, list[Path]]:
-    """Get the final clusterN_N.pdb stuctures."""
-    cluster_regex = r"cluster(\d+)_\d+.pdb"
-    cluster_dic: dict[int, list[Path]] = {}
-    for element in sorted(path.glob("*pdb")):
-        match = re.search(cluster_regex, str(element))
-        if match:
-            cluster_name = int(match.group(1))
-            if cluster_name not in cluster_dic:
-                cluster_dic[cluster_name] = []
-            cluster_dic[cluster_name].append(element)
-    return cluster_dic
-
-
-def list_to_range(lst):
-    """Convert a list to ranges."""
-    # thanks: https://stackoverflow.com/a/4629241
-    for a, b in itertools.groupby(enumerate(lst), lambda pair: pair[1] - pair[0]):
-        b = list(b)
-        yield b[0][1], b[-1][1]
-
-
-def get_probability(run_cns):
-    """Read the run.cns and look for noecv/ncvpart."""
-    noecv = False
-    ncvpart = 0.0
-    probability = 0.0
-    with open(run_cns, "r") as fh:
+
+def read_manifest(manifest: Path) -> list[Path]:
+    """Read the run directories listed in a manifest, one per line."""
+    rundir_list = []
+    with open(manifest, "r") as fh:
         for line in fh.readlines():
-            if "noecv" in line and "true" in line:
-                noecv = True
-            if "ncvpart" in line:
-                match = re.search(PARAM_REGEX, line)
-                if match:
-                    value = float(match.group(2))
-                    ncvpart = float(value)
-
-    if not noecv:
-        probability = 1
-    elif ncvpart == 0.0:
-        # noecv = true but nvcpart not defined
-        #  handle this here
-        pass
+            line = line.split("#")[0].strip()
+            if line:
+                rundir_list.append(Path(line))
+    return rundir_list
+
+
+def check_run(rundir: Path) -> list[str]:
+    """Index the inputs of a run directory, or run archive, and get its problems."""
+    if not is_archive(rundir):
+        index = RunIndex(rundir).scan()
+        for line in index.summary():
+            log.debug(line)
+        return index.get_problems()
+
+    # an archive is indexed from the listing of its members, nothing is unpacked
+    member_list = RunArchive(rundir).list_run()
+    return RunIndex(rundir).add_members(member_list).get_problems()
+
+
+def check_runs(rundir_list: list[Path]) -> bool:
+    """Check that the runs have all the inputs of a conversion, without converting."""
+    failed = 0
+    for rundir in rundir_list:
+        try:
+            problem_list = check_run(rundir)
+        except Exception as err:
+            problem_list = [repr(err)]
+
+        if problem_list:
+            failed += 1
+            log.error(f"{rundir}: {', '.join(problem_list)}")
+        else:
+            log.info(f"{rundir}: OK")
+
+    log.info(f"Check finished: {len(rundir_list) - failed} OK, {failed} incomplete")
+    return not failed
+
+
+def get_output_names(rundir_list: list[Path]) -> list[str]:
+    """Name the output of each run after the run, uniquely within the batch.
+
+    Runs with the same name, `a/run1` and `b/run1`, are told apart by the
+    names of their parent directories, `a_run1` and `b_run1`.
+    """
+    # named from the absolute paths, `.`, `..` or `run1/` have a name there
+    path_list = [Path(os.path.abspath(rundir)) for rundir in rundir_list]
+    name_list = [get_run_name(path) for path in path_list]
+    parent_list = [
+        [parent.name for parent in path.parents if parent.name] for path in path_list
+    ]
+    depth_list = [0] * len(rundir_list)
+
+    while True:
+        name_counts = Counter(name_list)
+        clash_list = [i for i, name in enumerate(name_list) if name_counts[name] > 1]
+        if not clash_list:
+            return name_list
+
+        renamed = False
+        for i in clash_list:
+            if depth_list[i] < len(parent_list[i]):
+                name_list[i] = f"{parent_list[i][depth_list[i]]}_{name_list[i]}"
+                depth_list[i] += 1
+                renamed = True
+
+        # the same run given twice, or a run next to its own archive
+        if not renamed:
+            clash = ", ".join(str(rundir_list[i]) for i in clash_list)
+            raise ValueError(f"Runs with the same output name: {clash}")
+
+
+def convert_batch(
+    rundir_list: list[Path], output_dir: Path, jobs: int = 1, **kwargs
+) -> bool:
+    """Convert many run directories, one `.cif` per run.
+
+    The keyword arguments are passed on to `convert`.
+    """
+    from haddock2mmcif.converter import convert
+
+    extension = get_output_extension(
+        kwargs.get("output_format") or "mmCIF", kwargs.get("compression")
+    )
+    output_list = [
+        Path(output_dir, f"{name}{extension}") for name in get_output_names(rundir_list)
+    ]
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # each run is converted in a single process, a failing run does not stop
+    #  the others and is reported in the summary
+    failed_dic = {}
+    if jobs > 1:
+        log.info(f"Converting {len(rundir_list)} runs with {jobs} jobs")
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            future_dic = {
+                executor.submit(convert, rundir, output_fname, **kwargs): rundir
+                for rundir, output_fname in zip(rundir_list, output_list)
+            }
+            for future in future_dic:
+                try:
+                    future.result()
+                except Exception as err:
+                    failed_dic[future_dic[future]] = err
     else:
-        probability = 1 / ncvpart
-
-    return probability
+        for rundir, output_fname in zip(rundir_list, output_list):
+            try:
+                convert(rundir, output_fname, **kwargs)
+            except Exception as err:
+                failed_dic[rundir] = err
 
+    log.info(
+        f"Batch finished: {len(rundir_list) - len(failed_dic)} converted, "
+        f"{len(failed_dic)} failed"
+    )
+    for rundir, err in failed_dic.items():
+        log.error(f"{rundir} failed: {err!r}")
 
-def get_flcut(run_cns):
-    """Retrieve the flcut parameter."""
-    cutoff = 5.0
-    with open(run_cns, "r") as fh:
-        for line in fh.readlines():
-            if "flcut" in line:
-                match = re.search(PARAM_REGEX, line)
-                if match:
-                    cutoff = float(match.group(2))
-
-    return cutoff
+    return not failed_dic
 
 
 def main():
     parser = argparse.ArgumentParser(description="")
-    parser.add_argument("rundir", type=str, help="")
+    parser.add_argument("rundir", type=str, nargs="*", help="")
     parser.add_argument("--output", type=str, help="")
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        help="File listing the run directories to convert, one per line",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        help="Where to write one `.cif` per run when converting several runs, "
+        "or any run given with --manifest, by default the current directory",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes used to load the models, "
+        "or to convert runs at once when converting several runs",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Keep only one model in memory, reading its atoms again when written",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        help="Directory where the loaded models and their interfaces are cached",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=1024,
+        help="Maximum size of the cache in MB",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Write the time and memory used by each stage and model to a JSON "
+        "report next to the output",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Reuse the models and restraints of a previous conversion to the "
+        "same output whose inputs did not change",
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=4,
+        help="Number of models read ahead in the background while loading "
+        "them with a single job, 0 to disable",
+    )
+    parser.add_argument(
+        "--ranking-metric",
+        type=parse_metric,
+        default="top4",
+        help="Score used to rank the clusters: topN for the mean of their N "
+        "first models, mean or median",
+    )
+    parser.add_argument(
+        "--evaluate-restraints",
+        action="store_true",
+        help="Write the distance of each restraint in each model, and if it is "
+        "satisfied",
+    )
+    parser.add_argument(
+        "--shards",
+        action="store_true",
+        help="Also write each cluster to its own mmCIF, in parallel with --jobs "
+        "processes, and merge them into the output",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Only check that the runs have all the files a conversion needs",
+    )
+    parser.add_argument(
+        "--format",
+        choices=list(FORMAT_EXTENSIONS),
+        help="Format of the output, by default from its extension "
+        "(.cif or .bcif, BinaryCIF needs msgpack)",
+    )
+    parser.add_argument(
+        "--compress",
+        choices=list(COMPRESSION_EXTENSIONS),
+        help="Compress the output while it is written, by default from its "
+        "extension (.gz or .xz)",
+    )
 
     args = parser.parse_args()
 
-    rundir = Path(args.rundir)
-    log.info(f"Input run directory: {rundir}")
-    run_cns = Path(rundir, "run.cns")
-
-    # ==============================================================
-    # Initialize the system
-    log.info("Initializing System")
-    system = ihm.System()
-
-    # ==============================================================
-    # Get contents of the simulation and create entities + asym units
-
-    # the complex_1.pdb has all the chains and it has been processed
-    #  by haddock, use this one to define the entities
-    log.info("Creating Asymetric Units")
-    begin_regex = r"(complex_1.pdb)"
-    begin_dir = Path(rundir, "begin")
-    entity_list = []
-    asym_dic = {}
-    for element in sorted(begin_dir.glob("*")):
-        match = re.search(begin_regex, str(element))
-        if match:
-            log.info(f"Reading {element}")
-            pdb = PDB(element)
-            pdb.load()
-
-            for chainID in pdb.seq_dic:
-                # create an entitity
-                seq = pdb.seq_dic[chainID]
-                log.info(f"Creating entity based on chain {chainID}")
-                entity = ihm.Entity(seq, description=f"Chain {chainID}")
-                entity_list.append(entity)
-
-                # create the assymetric unit
-                mapping = pdb.map_dic[chainID]
-                asym = ihm.AsymUnit(
-                    entity, auth_seq_id_map=mapping, details=f"Subunit {chainID}"
-                )
-                asym_dic[chainID] = asym
-
-    # Add them to the system
-    log.info("Adding Asymetric Units to the System")
-    system.entities.extend(entity_list)
-    system.asym_units.extend(list(asym_dic.values()))
-
-    # ==============================================================
-    # Organize into an assembly
-    log.info("Organizing Asymetric Units into Modeled Assembly")
-    modeled_assembly = ihm.Assembly(list(asym_dic.values()), name="Modeled assembly")
-
-    # ==============================================================
-    # Add the protocol
-    log.info("Defining the protocol")
-    protocol = ihm.protocol.Protocol(name="HADDOCK")
-
-    # ==============================================================
-    # Rank the clusters since the cluster_name is not its ranking
-    water_dir = Path(rundir, "structures", "it1", "water")
-    water_analysis_dir = Path(water_dir, "analysis")
-    cluster_out = Path(water_analysis_dir, "cluster.out")
-    file_list = Path(water_dir, "file.list")
-
-    log.info(f"Ranking the clusters from {cluster_out} based on {file_list}")
-    cluster_ranking = rank_clusters(cluster_out, file_list)
-
-    # ==============================================================
-    # Generate the models based on the clusters
-    clustered_structures = get_final_models(rundir)
-
-    log.info(f"Getting the interface cutoff from {run_cns}")
-    interface_cutoff = get_flcut(run_cns)
-
-    group_list = []
-    for ranking in cluster_ranking:
-        cluster_name = cluster_ranking[ranking]
-
-        # Haddock only generates clusters that contain a minimum number of models
-        if cluster_name not in clustered_structures:
-            continue
-
-        model_list = []
-        for structure in clustered_structures[cluster_name]:
-            log.info(f"Processing {structure.name}")
-            cluster_pdb = PDB(structure)
-            cluster_pdb.load()
-
-            model_id = int(structure.stem.split("_")[1])
-
-            # each model has 2 representations
-            #  one is the whole structure as rigid
-            #  second is its interface as flexible
-            cluster_pdb.get_interface(cutoff=interface_cutoff)
-
-            rep_list = []
-            for chainID in cluster_pdb.interface_dic:
-                asym = asym_dic[chainID]
-
-                interface_reslist = cluster_pdb.interface_dic[chainID]
-
-                rigid_rep = ihm.representation.AtomicSegment(asym, rigid=True)
-                rep_list.append(rigid_rep)
-
-                for elements in list_to_range(interface_reslist):
-                    start, end = elements
-                    rng = asym(start, end)
-                    flex_rep = ihm.representation.AtomicSegment(rng, rigid=False)
-                    rep_list.append(flex_rep)
-
-            rep = ihm.representation.Representation(rep_list)
-
-            model = DockingModel(
-                assembly=modeled_assembly,
-                protocol=protocol,
-                representation=rep,
-                name=f"model {model_id}",
-                assymetric_dic=asym_dic,
-                atom_list=cluster_pdb.atom_list,
-            )
-
-            model_list.append(model)
-
-        # one group per cluster
-        log.info(f"Finalizing group cluster Rank: {ranking} Number:{cluster_name}")
-        _group_name = f"Cluster {ranking} (#{cluster_name})"
-        model_group = ihm.model.ModelGroup(model_list, name=_group_name)
-        group_list.append(model_group)
-
-    # ==============================================================
-    # Groups are then placed into states, which can in turn be grouped.
-    log.info("Adding the groups to a state")
-    state = ihm.model.State(group_list)
-    system.state_groups.append(ihm.model.StateGroup([state]))
-
-    # ==============================================================
-    # Add the ambiguous restraints
-    log.info("Adding Ambiguous Restraints")
-    restraint_dir = Path(rundir, "data", "distances")
-
-    ambig_tbl_f = Path(restraint_dir, "ambig.tbl")
-
-    log.info(f"Reading {ambig_tbl_f}")
-    ambig = AmbigRestraint(ambig_tbl_f)
-    ambig.load()
-
-    loc = ihm.location.InputFileLocation(str(ambig_tbl_f))
-    amig_dataset = ihm.dataset.Dataset(loc)
-    log.info(f"Getting probability from {run_cns}")
-    prob = get_probability(run_cns)
-    for i, active in enumerate(ambig.tbl_dic):
-        # Imporant, the `active_res` is related to the `ambig.tbl` file,
-        #  to add it to the system, it needs to be mapped to the asymetric unit
-        active_res, active_segid = active
-
-        # Get the asymetric unit
-        active_asym = asym_dic[active_segid]
-
-        # Map the residue back to the asymetric unit numbering
-        mapped_active_res = backmap(active_asym.auth_seq_id_map, active_res)
-
-        active_rng = active_asym(mapped_active_res, mapped_active_res)
-
-        passive_l = ambig.tbl_dic[active]
-        passive_ranges = []
-        for element in passive_l:
-            # Imporant, the `passive_res` is related to the `ambig.tbl` file,
-            #  to add it to the system, it needs to be mapped to the asymetric unit
-            passive_res, passive_segid = element
-
-            # Get the asymetric unit
-            passive_asym = asym_dic[passive_segid]
-
-            # Map the residue back to the asymetric unit numbering
-            mapped_passive_res = backmap(passive_asym.auth_seq_id_map, passive_res)
-
-            passive_rng = passive_asym(mapped_passive_res, mapped_passive_res)
-
-            passive_ranges.append(passive_rng)
-
-        active = ihm.restraint.ResidueFeature(
-            [active_rng], details=f"Ambig AIR {i+1} Active"
-        )
-        passive = ihm.restraint.ResidueFeature(
-            passive_ranges, details=f"Ambig AIR {i+1} Passive"
+    rundir_list = [Path(rundir) for rundir in args.rundir]
+    if args.manifest:
+        rundir_list.extend(read_manifest(Path(args.manifest)))
+
+    if not rundir_list:
+        parser.error("no run directory given")
+
+    if args.check:
+        sys.exit(0 if check_runs(rundir_list) else 1)
+
+    # the shards are merged as text, this is known before any run is read
+    output_format = args.format
+    if output_format is None and args.output:
+        output_format, _ = parse_output_name(args.output)
+    if args.shards and output_format not in (None, "mmCIF"):
+        parser.error("--shards can only write mmCIF outputs")
+
+    # a manifest or an output directory is a batch, even of a single run
+    if len(rundir_list) > 1 or args.manifest or args.output_dir:
+        if args.output:
+            parser.error("--output cannot be used with several runs, see --output-dir")
+        try:
+            get_output_names(rundir_list)
+        except ValueError as err:
+            parser.error(str(err))
+        success = convert_batch(
+            rundir_list,
+            Path(args.output_dir or "."),
+            jobs=args.jobs,
+            stream=args.stream,
+            cache_dir=args.cache_dir,
+            cache_size=args.cache_size,
+            profile=args.profile,
+            incremental=args.incremental,
+            output_format=args.format,
+            compression=args.compress,
+            prefetch=args.prefetch,
+            ranking_metric=args.ranking_metric,
+            evaluate_restraints=args.evaluate_restraints,
+            shards=args.shards,
         )
+        if not success:
+            sys.exit(1)
+        return
 
-        dist = ihm.restraint.UpperBoundDistanceRestraint(2.0)
+    from haddock2mmcif.converter import convert
 
-        restraint = ihm.restraint.DerivedDistanceRestraint(
-            dataset=amig_dataset,
-            feature1=active,
-            feature2=passive,
-            distance=dist,
-            probability=prob,
-        )
-
-        log.info(f"Adding Restraint {i+1} to System")
-        # system.orphan_features.append(active)
-        # system.orphan_features.append(passive)
-        system.restraints.append(restraint)
-
-    # ==============================================================
-    # Add the unambiguous restraints
-    log.info("Adding unambiguous restraints")
-    unambig_tbl_f = Path(restraint_dir, "unambig.tbl")
-    unambig = UnambigRestraint(unambig_tbl_f)
-    unambig.load()
-
-    loc = ihm.location.InputFileLocation(str(unambig_tbl_f))
-    unamig_dataset = ihm.dataset.Dataset(loc)
-
-    for i, element in enumerate(unambig.tbl_list):
-        res_i, segid_i, res_j, segid_j, distance, lower_bound, upper_bound = element
-        asym_i = asym_dic[segid_i]
-        asym_j = asym_dic[segid_j]
-
-        rng_i = asym_i(res_i, res_i)
-        rng_j = asym_j(res_j, res_j)
-
-        rest_i = ihm.restraint.ResidueFeature([rng_i], details=f"Unambig AIR {i+1}_i")
-        rest_j = ihm.restraint.ResidueFeature([rng_j], details=f"Unambig AIR {i+1}_j")
-
-        lower = distance - lower_bound
-        upper = distance + upper_bound
-
-        distance = ihm.restraint.LowerUpperBoundDistanceRestraint(lower, upper)
-
-        restraint = ihm.restraint.DerivedDistanceRestraint(
-            dataset=unamig_dataset,
-            feature1=rest_i,
-            feature2=rest_j,
-            distance=distance,
-            probability=prob,
-        )
-
-        system.restraints.append(restraint)
-
-    # ==============================================================
-    # System is complete, write it to an mmCIF file:
     if args.output:
         output_fname = args.output
     else:
-        output_fname = "output.cif"
-
-    log.info(f"Dumping to {output_fname}")
+        output_fname = "output" + get_output_extension(
+            args.format or "mmCIF", args.compress
+        )
 
-    with open(f"{output_fname}", "w") as fh:
-        ihm.dumper.write(fh, [system])
+    convert(
+        rundir_list[0],
+        output_fname,
+        jobs=args.jobs,
+        stream=args.stream,
+        cache_dir=args.cache_dir,
+        cache_size=args.cache_size,
+        profile=args.profile,
+        incremental=args.incremental,
+        output_format=args.format,
+        compression=args.compress,
+        prefetch=args.prefetch,
+        ranking_metric=args.ranking_metric,
+        evaluate_restraints=args.evaluate_restraints,
+        shards=args.shards,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,708 @@
+import logging
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import ihm
+import ihm.dataset
+import ihm.dumper
+import ihm.location
+import ihm.model
+import ihm.protocol
+import ihm.representation
+import ihm.restraint
+
+from haddock2mmcif.modules.archive import RunArchive, is_archive
+from haddock2mmcif.modules.cache import CachedPDB, ModelCache
+from haddock2mmcif.modules.docking import DockingModel
+from haddock2mmcif.modules.features import FeatureCache
+from haddock2mmcif.modules.incremental import RunManifest
+from haddock2mmcif.modules.metrics import get_top
+from haddock2mmcif.modules.output import get_output_format, open_output
+from haddock2mmcif.modules.parameters import RunParameters
+from haddock2mmcif.modules.pdb import PDB
+from haddock2mmcif.modules.prefetch import map_prefetched
+from haddock2mmcif.modules.profiler import Profiler, measure
+from haddock2mmcif.modules.ranking import (
+    get_cluster_stats,
+    get_ranking,
+    read_clusters,
+    read_scores,
+)
+from haddock2mmcif.modules.restraints import AmbigRestraint, UnambigRestraint
+from haddock2mmcif.modules.runindex import RunIndex
+from haddock2mmcif.modules.satisfaction import RestraintEvaluator, RestraintFitDumper
+from haddock2mmcif.modules.shards import can_splice_atoms, merge_shards, write_shards
+
+log = logging.getLogger("log")
+
+
+def rank_clusters(
+    cluster_out: Path, file_list: Path, metric: str = "top4"
+) -> tuple[dict[int, int], dict[int, dict]]:
+    """Rank the clusters based on their combined score.
+
+    Returns the ranking, `{ranking: cluster_name}`, and the score statistics
+    of each cluster.
+    """
+    scores = read_scores(file_list)
+    cluster_dic = read_clusters(cluster_out)
+    stats_dic = get_cluster_stats(cluster_dic, scores, top=get_top(metric))
+    return get_ranking(stats_dic, metric), stats_dic
+
+
+def get_probability(params: RunParameters) -> float:
+    """Get the restraint probability from noecv/ncvpart."""
+    probability = 0.0
+    if not params.noecv:
+        probability = 1
+    elif params.ncvpart == 0.0:
+        # noecv = true but nvcpart not defined
+        #  handle this here
+        pass
+    else:
+        probability = 1 / params.ncvpart
+
+    return probability
+
+
+def get_flcut(params: RunParameters) -> float:
+    """Retrieve the flcut parameter."""
+    return params.flcut
+
+
+def load_model(
+    structure: Path, cutoff: float, stream: bool = False, cache=None, data=None
+) -> PDB:
+    """Load a clusterN_N.pdb structure and find its interface.
+
+    `data` are the contents of the structure, if they were already read.
+    """
+    cluster_pdb = cache.get(structure, cutoff, data) if cache else None
+    if cluster_pdb:
+        log.info(f"Processing {structure.name} (cached)")
+    else:
+        log.info(f"Processing {structure.name}")
+        cluster_pdb = PDB(structure)
+        if data is None:
+            cluster_pdb.load()
+        else:
+            cluster_pdb.parse(data)
+
+        # each model has 2 representations
+        #  one is the whole structure as rigid
+        #  second is its interface as flexible
+        cluster_pdb.get_interface(cutoff=cutoff)
+
+        if cache:
+            cache.put(cluster_pdb, cutoff)
+
+    # the atoms will be read again when the model is written
+    if stream:
+        cluster_pdb.unload()
+
+    return cluster_pdb
+
+
+def load_models(
+    structure_list: list[Path],
+    cutoff: float,
+    jobs: int = 1,
+    stream: bool = False,
+    cache=None,
+    profiler=None,
+    prefetch: int = 0,
+) -> dict[Path, PDB]:
+    """Load the models and find their interfaces.
+
+    With a single job, the next `prefetch` models are read in the background
+    while the current one is processed.
+    """
+    # this is independent for each model so it can be spread across
+    #  processes, `map` keeps the order
+    _load_model = partial(load_model, cutoff=cutoff, stream=stream, cache=cache)
+    if profiler:
+        # the usage is measured where the model is loaded, in the worker
+        _load_model = partial(measure, _load_model)
+
+    if jobs > 1:
+        log.info(f"Loading {len(structure_list)} models with {jobs} jobs")
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            pdb_list = list(executor.map(_load_model, structure_list))
+    elif prefetch > 0:
+        pdb_list = map_prefetched(_load_model, structure_list, depth=prefetch)
+    else:
+        pdb_list = list(map(_load_model, structure_list))
+
+    if profiler:
+        for structure, (_, usage) in zip(structure_list, pdb_list):
+            profiler.add_model(structure.name, usage)
+        pdb_list = [pdb for pdb, _ in pdb_list]
+
+    return dict(zip(structure_list, pdb_list))
+
+
+def reuse_models(
+    structure_list: list[Path], interface_results, cutoff: float, cache=None
+) -> dict[Path, PDB]:
+    """Restore the models of a previous conversion from their interfaces.
+
+    The atoms are read back from the `cache` when the models are written,
+    without parsing the models again.
+    """
+    pdb_dic = {}
+    for structure in structure_list:
+        # the atoms are not loaded, they are read when the model is written
+        if cache:
+            cluster_pdb = CachedPDB(structure, cache, cutoff)
+        else:
+            cluster_pdb = PDB(structure)
+        cluster_pdb.interface_dic = {
+            chain: set(residues)
+            for chain, residues in interface_results[structure.name].items()
+        }
+        pdb_dic[structure] = cluster_pdb
+    return pdb_dic
+
+
+def create_entities(complex_pdb: Path):
+    """Create the entities and asymetric units from the chains in complex_1.pdb."""
+    # the complex_1.pdb has all the chains and it has been processed
+    #  by haddock, use this one to define the entities
+    entity_list = []
+    asym_dic = {}
+    seq_id_dic = {}
+    log.info(f"Reading {complex_pdb}")
+    pdb = PDB(complex_pdb)
+    pdb.load()
+
+    for chainID in pdb.seq_dic:
+        # create an entitity
+        seq = pdb.seq_dic[chainID]
+        log.info(f"Creating entity based on chain {chainID}")
+        entity = ihm.Entity(seq, description=f"Chain {chainID}")
+        entity_list.append(entity)
+
+        # create the assymetric unit
+        mapping = pdb.map_dic[chainID]
+        asym = ihm.AsymUnit(
+            entity, auth_seq_id_map=mapping, details=f"Subunit {chainID}"
+        )
+        asym_dic[chainID] = asym
+
+        # the inverse mapping, used to map the restraints
+        seq_id_dic[chainID] = pdb.seq_id_dic[chainID]
+
+    return entity_list, asym_dic, seq_id_dic
+
+
+def create_representation(interface_ranges, asym_dic):
+    """Represent each chain as rigid, except for its interface residues."""
+    rep_list = []
+    for chainID in interface_ranges:
+        asym = asym_dic[chainID]
+
+        rigid_rep = ihm.representation.AtomicSegment(asym, rigid=True)
+        rep_list.append(rigid_rep)
+
+        for elements in interface_ranges[chainID]:
+            start, end = elements
+            rng = asym(start, end)
+            flex_rep = ihm.representation.AtomicSegment(rng, rigid=False)
+            rep_list.append(flex_rep)
+
+    return ihm.representation.Representation(rep_list)
+
+
+def create_model_groups(
+    cluster_ranking, clustered_structures, pdb_dic, asym_dic, assembly, protocol
+):
+    """Create one ModelGroup per cluster, in ranking order."""
+    group_list = []
+    rep_dic = {}
+    for ranking in cluster_ranking:
+        cluster_name = cluster_ranking[ranking]
+
+        # Haddock only generates clusters that contain a minimum number of models
+        if cluster_name not in clustered_structures:
+            continue
+
+        model_list = []
+        for structure in clustered_structures[cluster_name]:
+            cluster_pdb = pdb_dic[structure]
+
+            model_id = int(structure.stem.split("_")[1])
+
+            # IMPORTANT: models with the same interface share their
+            #  representation, so it is written only once
+            interface_ranges = cluster_pdb.get_interface_ranges()
+            signature = tuple(
+                (chainID, tuple(ranges)) for chainID, ranges in interface_ranges.items()
+            )
+            if signature not in rep_dic:
+                rep_dic[signature] = create_representation(interface_ranges, asym_dic)
+            rep = rep_dic[signature]
+
+            model = DockingModel(
+                assembly=assembly,
+                protocol=protocol,
+                representation=rep,
+                name=f"model {model_id}",
+                assymetric_dic=asym_dic,
+                pdb=cluster_pdb,
+            )
+
+            model_list.append(model)
+
+        # one group per cluster
+        log.info(f"Finalizing group cluster Rank: {ranking} Number:{cluster_name}")
+        _group_name = f"Cluster {ranking} (#{cluster_name})"
+        model_group = ihm.model.ModelGroup(model_list, name=_group_name)
+        group_list.append(model_group)
+
+    return group_list
+
+
+def read_ambig(ambig_tbl_f: Path, manifest=None) -> AmbigRestraint:
+    """Read an ambig.tbl, or reuse its restraints from a previous conversion."""
+    ambig = AmbigRestraint(ambig_tbl_f)
+    inputs = manifest.digest([ambig_tbl_f]) if manifest else None
+    records = manifest.get_results("ambig", inputs) if manifest else None
+    if records is not None:
+        ambig.tbl_dic = {
+            tuple(active): [tuple(passive) for passive in passive_l]
+            for active, passive_l in records
+        }
+    else:
+        log.info(f"Reading {ambig_tbl_f}")
+        ambig.load()
+
+    if manifest:
+        manifest.update("ambig", inputs, list(ambig.tbl_dic.items()))
+
+    return ambig
+
+
+def read_unambig(unambig_tbl_f: Path, manifest=None) -> UnambigRestraint:
+    """Read an unambig.tbl, or reuse its restraints from a previous conversion."""
+    unambig = UnambigRestraint(unambig_tbl_f)
+    inputs = manifest.digest([unambig_tbl_f]) if manifest else None
+    records = manifest.get_results("unambig", inputs) if manifest else None
+    if records is not None:
+        unambig.tbl_list = [
+            (
+                [tuple(atom) for atom in side_i],
+                [tuple(atom) for atom in side_j],
+                distance,
+                lower,
+                upper,
+            )
+            for side_i, side_j, distance, lower, upper in records
+        ]
+    else:
+        log.info(f"Reading {unambig_tbl_f}")
+        unambig.load()
+
+    if manifest:
+        manifest.update("unambig", inputs, unambig.tbl_list)
+
+    return unambig
+
+
+def get_input_location(input_f: Path, source=None):
+    """Locate an input file, under `source` if it was unpacked from an archive."""
+    loc = ihm.location.InputFileLocation(str(input_f))
+    if source:
+        # IMPORTANT: the unpacked file is removed after the conversion, the
+        #  output points to it inside the archive instead
+        loc.path = os.path.abspath(source)
+    return loc
+
+
+def add_ambig_restraints(
+    system,
+    ambig: AmbigRestraint,
+    asym_dic,
+    seq_id_dic,
+    prob,
+    feature_cache=None,
+    source=None,
+):
+    """Add the ambiguous restraints of an ambig.tbl to the system."""
+    loc = get_input_location(ambig.tbl_file, source)
+    amig_dataset = ihm.dataset.Dataset(loc)
+    if feature_cache is None:
+        feature_cache = FeatureCache(asym_dic)
+
+    for i, active in enumerate(ambig.tbl_dic):
+        # Imporant, the `active_res` is related to the `ambig.tbl` file,
+        #  to add it to the system, it needs to be mapped to the asymetric unit
+        active_res, active_segid = active
+
+        # Map the residue back to the asymetric unit numbering
+        mapped_active_res = seq_id_dic[active_segid][active_res]
+
+        passive_l = ambig.tbl_dic[active]
+        passive_residues = []
+        for element in passive_l:
+            # Imporant, the `passive_res` is related to the `ambig.tbl` file,
+            #  to add it to the system, it needs to be mapped to the asymetric unit
+            passive_res, passive_segid = element
+
+            # Map the residue back to the asymetric unit numbering
+            mapped_passive_res = seq_id_dic[passive_segid][passive_res]
+
+            passive_residues.append((passive_segid, mapped_passive_res))
+
+        # IMPORTANT: the same residues recur across many restraints, their
+        #  features are shared so they are written only once
+        active = feature_cache.get_feature([(active_segid, mapped_active_res)])
+        passive = feature_cache.get_feature(passive_residues)
+
+        dist = ihm.restraint.UpperBoundDistanceRestraint(2.0)
+
+        restraint = ihm.restraint.DerivedDistanceRestraint(
+            dataset=amig_dataset,
+            feature1=active,
+            feature2=passive,
+            distance=dist,
+            probability=prob,
+        )
+
+        log.info(f"Adding Restraint {i+1} to System")
+        # system.orphan_features.append(active)
+        # system.orphan_features.append(passive)
+        system.restraints.append(restraint)
+
+
+def get_side_feature(feature_cache, side, seq_id_dic):
+    """Get the feature of a side of an unambiguous restraint."""
+    mapped_side = [
+        (segid, seq_id_dic[segid][resid], name) for resid, segid, name in side
+    ]
+    if all(name is not None for _, _, name in mapped_side):
+        return feature_cache.get_atom_feature(mapped_side)
+    return feature_cache.get_feature(
+        [(segid, seq_id) for segid, seq_id, _ in mapped_side]
+    )
+
+
+def add_unambig_restraints(
+    system,
+    unambig: UnambigRestraint,
+    asym_dic,
+    seq_id_dic,
+    prob,
+    feature_cache=None,
+    source=None,
+):
+    """Add the unambiguous restraints of an unambig.tbl to the system."""
+    loc = get_input_location(unambig.tbl_file, source)
+    unamig_dataset = ihm.dataset.Dataset(loc)
+    if feature_cache is None:
+        feature_cache = FeatureCache(asym_dic)
+
+    for element in unambig.tbl_list:
+        side_i, side_j, distance, lower_bound, upper_bound = element
+
+        # Map the residues back to the asymetric unit numbering, as the
+        #  ambiguous restraints are, a restraint between atoms is kept as
+        #  such, otherwise it is between the whole residues
+        rest_i = get_side_feature(feature_cache, side_i, seq_id_dic)
+        rest_j = get_side_feature(feature_cache, side_j, seq_id_dic)
+
+        lower = distance - lower_bound
+        upper = distance + upper_bound
+
+        distance = ihm.restraint.LowerUpperBoundDistanceRestraint(lower, upper)
+
+        restraint = ihm.restraint.DerivedDistanceRestraint(
+            dataset=unamig_dataset,
+            feature1=rest_i,
+            feature2=rest_j,
+            distance=distance,
+            probability=prob,
+        )
+
+        system.restraints.append(restraint)
+
+
+def write_system(system, output_fname, output_format="mmCIF", compression=None):
+    """Write the system to an mmCIF or BinaryCIF file, optionally compressed."""
+    log.info(f"Dumping to {output_fname}")
+
+    with open_output(output_fname, output_format, compression) as fh:
+        ihm.dumper.write(
+            fh, [system], format=output_format, dumpers=[RestraintFitDumper]
+        )
+
+
+def write_sharded_system(system, output_fname, compression=None, jobs=1):
+    """Write each cluster to its own mmCIF, in parallel, then merge them."""
+    shard_dir = Path(output_fname).with_suffix(".shards")
+    log.info(f"Writing one shard per cluster to {shard_dir} with {jobs} jobs")
+    shard_list = write_shards(system, shard_dir, jobs=jobs)
+
+    if not can_splice_atoms():
+        log.warning(
+            f"The shards cannot be merged with ihm {ihm.__version__}, "
+            f"writing {output_fname} from the whole system"
+        )
+        write_system(system, output_fname, compression=compression)
+        return
+
+    log.info(f"Merging the {len(shard_list)} shards to {output_fname}")
+    merge_shards(system, shard_list, output_fname, compression)
+
+
+def convert(rundir: Path, output_fname, **kwargs):
+    """Encode a HADDOCK run directory, or a run archive, into an mmCIF file.
+
+    The keyword arguments are passed on to `convert_rundir`.
+    """
+    if not is_archive(rundir):
+        return convert_rundir(Path(rundir), output_fname, **kwargs)
+
+    # only the files read by the conversion are unpacked, and only until it ends
+    with tempfile.TemporaryDirectory() as tmpdir:
+        log.info(f"Unpacking the run files from {rundir}")
+        archive = RunArchive(rundir)
+        run_root = archive.extract(tmpdir)
+        return convert_rundir(
+            run_root, output_fname, source_dir=archive.source_dir, **kwargs
+        )
+
+
+def convert_rundir(
+    rundir: Path,
+    output_fname,
+    jobs: int = 1,
+    stream: bool = False,
+    cache_dir=None,
+    cache_size: int = 1024,
+    profile: bool = False,
+    incremental: bool = False,
+    output_format=None,
+    compression=None,
+    prefetch: int = 4,
+    ranking_metric: str = "top4",
+    evaluate_restraints: bool = False,
+    shards: bool = False,
+    source_dir=None,
+):
+    """Encode a HADDOCK run directory into an mmCIF file.
+
+    `source_dir` is where the run directory comes from, if it was unpacked
+    from an archive.
+    """
+    # the stages are always timed, it is cheap, the models only with `profile`
+    profiler = Profiler()
+
+    # checked first, so a missing dependency does not fail the conversion at its end
+    output_format, compression = get_output_format(
+        output_fname, output_format, compression
+    )
+    if shards and output_format != "mmCIF":
+        raise ValueError("Sharded outputs can only be written as mmCIF")
+
+    # the manifest of the previous conversion tells which sections can be reused
+    manifest = None
+    if incremental:
+        manifest = RunManifest(Path(output_fname).with_suffix(".manifest.json"))
+        manifest.load()
+
+    log.info(f"Input run directory: {source_dir or rundir}")
+
+    # all the inputs are found at once, a broken run fails before any is read
+    index = RunIndex(rundir).scan()
+    index.check()
+
+    with profiler.stage("parameters"):
+        log.info(f"Reading the run parameters from {index.run_cns}")
+        params = RunParameters(index.run_cns)
+        params.load()
+
+    # ==============================================================
+    # Initialize the system
+    log.info("Initializing System")
+    system = ihm.System()
+
+    # ==============================================================
+    # Get contents of the simulation and create entities + asym units
+    with profiler.stage("entities"):
+        log.info("Creating Asymetric Units")
+        entity_list, asym_dic, seq_id_dic = create_entities(index.complex_pdb)
+
+    # Add them to the system
+    log.info("Adding Asymetric Units to the System")
+    system.entities.extend(entity_list)
+    system.asym_units.extend(list(asym_dic.values()))
+
+    # ==============================================================
+    # Organize into an assembly
+    log.info("Organizing Asymetric Units into Modeled Assembly")
+    modeled_assembly = ihm.Assembly(list(asym_dic.values()), name="Modeled assembly")
+
+    # ==============================================================
+    # Add the protocol
+    log.info("Defining the protocol")
+    protocol = ihm.protocol.Protocol(name="HADDOCK")
+
+    # ==============================================================
+    # Rank the clusters since the cluster_name is not its ranking
+    with profiler.stage("ranking"):
+        log.info(
+            f"Ranking the clusters from {index.cluster_out} "
+            f"based on {index.file_list}"
+        )
+        cluster_ranking, cluster_stats = rank_clusters(
+            index.cluster_out, index.file_list, metric=ranking_metric
+        )
+        for ranking, cluster_name in cluster_ranking.items():
+            stats = cluster_stats[cluster_name]
+            log.info(
+                f"Cluster {cluster_name} ranked {ranking}: {stats['size']} models, "
+                f"top{get_top(ranking_metric)} {stats['top_mean']:.3f}, "
+                f"mean {stats['mean']:.3f}, median {stats['median']:.3f}"
+            )
+
+    # ==============================================================
+    # Generate the models based on the clusters
+    clustered_structures = index.cluster_models
+
+    interface_cutoff = get_flcut(params)
+
+    structure_list = [
+        structure
+        for cluster_name in cluster_ranking.values()
+        if cluster_name in clustered_structures
+        for structure in clustered_structures[cluster_name]
+    ]
+    # an incremental conversion keeps the atoms of its models next to its
+    #  output, unless there is a cache already, to reuse them without parsing
+    if incremental and not cache_dir:
+        cache_dir = Path(output_fname).with_suffix(".models")
+    cache = None
+    if cache_dir:
+        log.info(f"Using the model cache in {cache_dir}")
+        cache = ModelCache(cache_dir, max_size=cache_size * 1024 * 1024)
+
+    with profiler.stage("models"):
+        pdb_dic = None
+        if manifest:
+            model_inputs = manifest.digest(structure_list, flcut=interface_cutoff)
+            # the cache is keyed by the same digests, no need to compute them again
+            cache.digest_dic.update(
+                (structure, model_inputs[structure.name])
+                for structure in structure_list
+            )
+            interface_results = manifest.get_results("models", model_inputs)
+            if interface_results is not None:
+                pdb_dic = reuse_models(
+                    structure_list, interface_results, interface_cutoff, cache=cache
+                )
+
+        if pdb_dic is None:
+            pdb_dic = load_models(
+                structure_list,
+                interface_cutoff,
+                jobs=jobs,
+                stream=stream,
+                cache=cache,
+                profiler=profiler if profile else None,
+                prefetch=prefetch,
+            )
+
+        if manifest:
+            interface_results = {
+                structure.name: {
+                    chain: sorted(residues)
+                    for chain, residues in cluster_pdb.interface_dic.items()
+                }
+                for structure, cluster_pdb in pdb_dic.items()
+            }
+            manifest.update("models", model_inputs, interface_results)
+
+    with profiler.stage("model groups"):
+        group_list = create_model_groups(
+            cluster_ranking,
+            clustered_structures,
+            pdb_dic,
+            asym_dic,
+            modeled_assembly,
+            protocol,
+        )
+
+    # ==============================================================
+    # Groups are then placed into states, which can in turn be grouped.
+    log.info("Adding the groups to a state")
+    state = ihm.model.State(group_list)
+    system.state_groups.append(ihm.model.StateGroup([state]))
+
+    # ==============================================================
+    # Add the ambiguous restraints
+    ambig_source = unambig_source = None
+    if source_dir:
+        ambig_source = Path(source_dir, "data", "distances", "ambig.tbl")
+        unambig_source = Path(source_dir, "data", "distances", "unambig.tbl")
+    prob = get_probability(params)
+    feature_cache = FeatureCache(asym_dic)
+
+    with profiler.stage("ambiguous restraints"):
+        log.info("Adding Ambiguous Restraints")
+        ambig = read_ambig(index.ambig_tbl, manifest=manifest)
+        add_ambig_restraints(
+            system,
+            ambig,
+            asym_dic,
+            seq_id_dic,
+            prob,
+            feature_cache=feature_cache,
+            source=ambig_source,
+        )
+
+    # ==============================================================
+    # Add the unambiguous restraints
+    with profiler.stage("unambiguous restraints"):
+        log.info("Adding unambiguous restraints")
+        unambig = read_unambig(index.unambig_tbl, manifest=manifest)
+        add_unambig_restraints(
+            system,
+            unambig,
+            asym_dic,
+            seq_id_dic,
+            prob,
+            feature_cache=feature_cache,
+            source=unambig_source,
+        )
+
+    # ==============================================================
+    # Check the restraints against each model
+    if evaluate_restraints:
+        with profiler.stage("restraint evaluation"):
+            log.info("Evaluating the restraints on the models")
+            evaluator = RestraintEvaluator(system.restraints, asym_dic)
+            for model_group in group_list:
+                for model in model_group:
+                    evaluator.evaluate_model(model)
+
+    # ==============================================================
+    # System is complete, write it to an mmCIF file:
+    with profiler.stage("dump"):
+        if shards:
+            write_sharded_system(system, output_fname, compression, jobs=jobs)
+        else:
+            write_system(system, output_fname, output_format, compression)
+
+    if manifest:
+        manifest.write()
+
+    if profile:
+        profiler.write(
+            Path(output_fname).with_suffix(".profile.json"),
+            rundir=str(source_dir or rundir),
+            output=str(output_fname),
+            jobs=jobs,
+        )
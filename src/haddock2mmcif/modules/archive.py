@@ -0,0 +1,138 @@
+import gzip
+import logging
+import re
+import shutil
+import tarfile
+import zipfile
+from pathlib import Path
+
+archlog = logging.getLogger("log")
+
+ARCHIVE_SUFFIXES = (".tgz", ".tar.gz", ".tar.xz", ".tar.bz2", ".tar", ".zip")
+
+# The files of a run read by a conversion, relative to the run directory, the
+#  run directory itself can be the top of the archive or a folder in it
+RUN_MEMBER_REGEX = re.compile(
+    r"(?:(?P<prefix>(?!\.\.?/)[^/]+)/)?"
+    r"(?P<name>run\.cns"
+    r"|begin/complex_1\.pdb"
+    r"|structures/it1/water/file\.list"
+    r"|structures/it1/water/analysis/cluster\.out"
+    r"|data/distances/[^/]+\.tbl"
+    r"|cluster\d+_\d+\.pdb)"
+    r"(?P<gz>\.gz)?"
+)
+
+
+def is_archive(path):
+    """Check if a path is a run archive rather than a run directory."""
+    return Path(path).is_file() and str(path).lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def get_run_name(path):
+    """Get the name of a run from its directory or archive."""
+    name = Path(path).name
+    for suffix in ARCHIVE_SUFFIXES:
+        if name.lower().endswith(suffix):
+            return name[: -len(suffix)]
+    return name
+
+
+class RunArchive:
+    """A HADDOCK run packed in a `.tgz` or `.zip`, as downloaded from the web server.
+
+    Only the members a conversion reads are unpacked, in a single pass over
+    the archive once the run is found in its listing, gzipped members are
+    uncompressed on the way.
+    """
+
+    def __init__(self, archive_f):
+        self.archive_f = Path(archive_f)
+        self.prefix = None
+
+    @property
+    def source_dir(self):
+        """The run directory, as a path inside the archive."""
+        return Path(self.archive_f, self.prefix or "")
+
+    def iter_members(self):
+        """Iterate over the `(name, file object)` of the regular files."""
+        if zipfile.is_zipfile(self.archive_f):
+            with zipfile.ZipFile(self.archive_f) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir():
+                        with archive.open(info) as fh:
+                            yield info.filename, fh
+        else:
+            # stream mode, the archive is read once from start to end
+            with tarfile.open(self.archive_f, "r|*") as archive:
+                for member in archive:
+                    if member.isfile():
+                        yield member.name, archive.extractfile(member)
+
+    def list_members(self):
+        """List the `(name, size)` of the regular files, without unpacking them."""
+        if zipfile.is_zipfile(self.archive_f):
+            with zipfile.ZipFile(self.archive_f) as archive:
+                return [
+                    (info.filename, info.file_size)
+                    for info in archive.infolist()
+                    if not info.is_dir()
+                ]
+
+        with tarfile.open(self.archive_f, "r|*") as archive:
+            return [(member.name, member.size) for member in archive if member.isfile()]
+
+    def list_run(self):
+        """List the `(path, size)` of the files of the run a conversion reads.
+
+        The paths are relative to the run directory and nothing is unpacked,
+        the size of a gzipped member is its compressed size.
+        """
+        member_dic = {}
+        for name, size in self.list_members():
+            if name.startswith("./"):
+                name = name[2:]
+            match = RUN_MEMBER_REGEX.fullmatch(name)
+            if match:
+                prefix, member_name = match.group("prefix", "name")
+                member_dic.setdefault(prefix, []).append((member_name, size))
+
+        prefix_list = [
+            prefix
+            for prefix, member_list in member_dic.items()
+            if any(member_name == "run.cns" for member_name, _ in member_list)
+        ]
+        if not prefix_list:
+            raise FileNotFoundError(f"No run.cns found in {self.archive_f}")
+
+        # the top-most run.cns belongs to the run directory
+        self.prefix = min(prefix_list, key=lambda prefix: prefix is not None)
+        return member_dic[self.prefix]
+
+    def extract(self, target_dir):
+        """Unpack the members a conversion needs, returning the run directory.
+
+        Only the members of the run are unpacked, not those of other runs
+        the archive may hold next to it or in its subfolders.
+        """
+        # the run is found from the listing, which is cheap for a zip
+        self.list_run()
+        target_dir = Path(target_dir)
+        for name, fh in self.iter_members():
+            if name.startswith("./"):
+                name = name[2:]
+            match = RUN_MEMBER_REGEX.fullmatch(name)
+            if not match or match.group("prefix") != self.prefix:
+                continue
+
+            member_name, gz = match.group("name", "gz")
+            member_f = Path(target_dir, self.prefix or "", member_name)
+            member_f.parent.mkdir(parents=True, exist_ok=True)
+            archlog.debug(f"Extracting {name} to {member_f}")
+            with open(member_f, "wb") as out_fh:
+                if gz:
+                    fh = gzip.GzipFile(fileobj=fh)
+                shutil.copyfileobj(fh, out_fh)
+
+        return Path(target_dir, self.prefix or "")
@@ -0,0 +1,179 @@
+import hashlib
+import json
+import logging
+import os
+import zipfile
+from pathlib import Path
+
+import numpy as np
+
+from haddock2mmcif.modules.pdb import PDB
+from haddock2mmcif.modules.utils import file_digest
+
+cachelog = logging.getLogger("log")
+
+# Bump this when the layout of the entries changes
+CACHE_VERSION = 1
+
+ARRAY_ATTRIBUTES = (
+    "coords",
+    "seq_ids",
+    "chain_codes",
+    "element_codes",
+    "atom_id_codes",
+)
+
+TABLE_ATTRIBUTES = ("chain_table", "element_table", "atom_id_table")
+
+
+class ModelCache:
+    """On-disk cache of loaded models and their interfaces.
+
+    Entries are keyed by the contents of the PDB file and the interface
+    cutoff and stored as uncompressed `.npz` files. When the cache grows above
+    `max_size` bytes the least recently used entries are removed.
+
+    The size of the cache is only listed when it is opened, and again when
+    the entries written since then may have taken it above `max_size`.
+    """
+
+    def __init__(self, cache_dir, max_size=1024 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.max_size = max_size
+        self.digest_dic = {}
+        self.total_size = 0
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.evict()
+
+    def entry_path(self, pdb_f, cutoff, data=None):
+        if pdb_f not in self.digest_dic:
+            # the contents may have been read already, no need to read them again
+            if data is None:
+                self.digest_dic[pdb_f] = file_digest(pdb_f)
+            else:
+                self.digest_dic[pdb_f] = hashlib.sha256(data).hexdigest()
+        key = f"{self.digest_dic[pdb_f]}_{cutoff}_v{CACHE_VERSION}"
+        return Path(self.cache_dir, f"{key}.npz")
+
+    def get(self, pdb_f, cutoff, data=None):
+        """Get the cached model of a PDB file, `None` if it is not cached.
+
+        `data` are the contents of the file, if they were already read.
+        """
+        entry = self.entry_path(pdb_f, cutoff, data)
+        try:
+            with np.load(entry, allow_pickle=False) as data:
+                pdb = PDB(pdb_f)
+                for attribute in ARRAY_ATTRIBUTES:
+                    setattr(pdb, attribute, data[attribute])
+                metadata = json.loads(str(data["metadata"]))
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, KeyError, ValueError, zipfile.BadZipFile) as err:
+            # a truncated or corrupt entry is a miss, it is written again
+            cachelog.warning(f"Removing the unreadable cache entry {entry.name}: {err}")
+            try:
+                entry.unlink(missing_ok=True)
+            except OSError:
+                pass
+            return None
+
+        for attribute in TABLE_ATTRIBUTES:
+            setattr(pdb, attribute, metadata[attribute])
+        pdb.seq_dic = metadata["seq_dic"]
+        for chain, mapping in metadata["map_dic"].items():
+            pdb.map_dic[chain] = {seq_id: resnum for seq_id, resnum in mapping}
+            pdb.seq_id_dic[chain] = {resnum: seq_id for seq_id, resnum in mapping}
+        pdb.interface_dic = {
+            chain: set(residues)
+            for chain, residues in metadata["interface_dic"].items()
+        }
+
+        # mark it as recently used
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+
+        return pdb
+
+    def put(self, pdb, cutoff):
+        """Store a loaded model and its interface."""
+        entry = self.entry_path(pdb.pdb_file, cutoff)
+        metadata = {
+            "chain_table": pdb.chain_table,
+            "element_table": pdb.element_table,
+            "atom_id_table": pdb.atom_id_table,
+            "seq_dic": pdb.seq_dic,
+            "map_dic": {
+                chain: list(mapping.items()) for chain, mapping in pdb.map_dic.items()
+            },
+            "interface_dic": {
+                chain: sorted(residues) for chain, residues in pdb.interface_dic.items()
+            },
+        }
+        arrays = {attribute: getattr(pdb, attribute) for attribute in ARRAY_ATTRIBUTES}
+
+        # write to a temporary file first, other processes may be reading
+        tmp_entry = entry.with_name(f"{entry.stem}.{os.getpid()}.tmp")
+        try:
+            with open(tmp_entry, "wb") as fh:
+                np.savez(fh, metadata=np.array(json.dumps(metadata)), **arrays)
+                size = fh.tell()
+            os.replace(tmp_entry, entry)
+        except OSError as err:
+            # a full disk or a read-only cache only costs the cache
+            cachelog.warning(f"Could not cache {pdb.pdb_file.name}: {err}")
+            try:
+                tmp_entry.unlink(missing_ok=True)
+            except OSError:
+                pass
+            return
+        self.total_size += size
+
+        if self.total_size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits."""
+        entry_list = []
+        for entry in self.cache_dir.glob("*.npz"):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entry_list.append((stat.st_mtime, stat.st_size, entry))
+
+        total_size = sum(size for _, size, _ in entry_list)
+        for _, size, entry in sorted(entry_list):
+            if total_size <= self.max_size:
+                break
+            cachelog.info(f"Evicting {entry.name} from the cache")
+            try:
+                entry.unlink()
+            except FileNotFoundError:
+                pass
+            total_size -= size
+        self.total_size = total_size
+
+
+class CachedPDB(PDB):
+    """A model whose atoms are read back from its cache entry, not its file.
+
+    Loading the arrays of an entry skips parsing the PDB, which is only
+    parsed if the entry has been evicted since.
+    """
+
+    def __init__(self, pdb_f, cache, cutoff):
+        super().__init__(pdb_f)
+        self.cache = cache
+        self.cutoff = cutoff
+
+    def load(self):
+        cached = self.cache.get(self.pdb_file, self.cutoff)
+        if cached is None:
+            super().load()
+            return
+
+        for attribute in ARRAY_ATTRIBUTES + TABLE_ATTRIBUTES:
+            setattr(self, attribute, getattr(cached, attribute))
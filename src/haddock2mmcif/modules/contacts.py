@@ -0,0 +1,69 @@
+import numpy as np
+
+# Offsets of the 27 cells that surround (and include) a given cell
+CELL_OFFSETS = np.array(
+    [(i, j, k) for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)],
+    dtype=np.int64,
+)
+
+
+def is_hydrogen(atom_names):
+    """Flag hydrogens using the same rule as the former contact-chainID tool."""
+    # Both the old (1HB) and the new (HB1) style hydrogen names are matched
+    first = np.array([name[:1] for name in atom_names], dtype=str)
+    second = np.array([name[1:2] for name in atom_names], dtype=str)
+    return (first == "H") | (np.char.isdigit(first) & (second == "H"))
+
+
+def find_contacts(coords, groups, cutoff):
+    """Find the atom pairs of different groups that are closer than `cutoff`.
+
+    The search is done with a cell list, each atom is only compared against
+    the atoms in its own cell and in the 26 neighbouring ones.
+
+    Returns the indices `i` and `j` (with `i < j`) of each pair and their distance.
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    groups = np.asarray(groups)
+    empty = np.empty(0, dtype=np.int64)
+    if len(coords) == 0 or cutoff <= 0:
+        return empty, empty, np.empty(0, dtype=np.float64)
+
+    # Assign each atom to a cell, padded by one so that neighbours never wrap
+    cells = np.floor((coords - coords.min(axis=0)) / cutoff).astype(np.int64) + 1
+    dims = cells.max(axis=0) + 2
+    strides = np.array([dims[1] * dims[2], dims[2], 1], dtype=np.int64)
+    keys = cells @ strides
+
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    cutoff_sq = cutoff * cutoff
+    pair_i, pair_j, pair_dist = [], [], []
+    for offset in CELL_OFFSETS:
+        neighbour_keys = keys + offset @ strides
+        start = np.searchsorted(sorted_keys, neighbour_keys, side="left")
+        end = np.searchsorted(sorted_keys, neighbour_keys, side="right")
+        counts = end - start
+        total = counts.sum()
+        if not total:
+            continue
+
+        # Expand every atom into one candidate pair per atom in the neighbour cell
+        i = np.repeat(np.arange(len(coords)), counts)
+        shift = np.repeat(start - (np.cumsum(counts) - counts), counts)
+        j = order[np.arange(total) + shift]
+
+        mask = (i < j) & (groups[i] != groups[j])
+        i, j = i[mask], j[mask]
+        dist_sq = ((coords[i] - coords[j]) ** 2).sum(axis=1)
+        close = dist_sq < cutoff_sq
+
+        pair_i.append(i[close])
+        pair_j.append(j[close])
+        pair_dist.append(np.sqrt(dist_sq[close]))
+
+    if not pair_i:
+        return empty, empty, np.empty(0, dtype=np.float64)
+
+    return np.concatenate(pair_i), np.concatenate(pair_j), np.concatenate(pair_dist)
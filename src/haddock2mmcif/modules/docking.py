@@ -13,20 +13,48 @@ class DockingModel(ihm.model.Model):
     #  [(<ihm.AsymUnit object...108edf5b0>, 1, 'C', 'CA', 1.0, 2.0, 3.0), ...]
     # Which means that the AsymUnit object will be copied many times and this
     #  will eat a lot of memory.
-    # To avoid this we subclass IHM Model class and override get_atoms function
+    # To avoid this we subclass IHM Model class and override get_atoms function,
+    #  the atoms are read from the columns of a loaded PDB object and the
+    #  ihm.model.Atom objects are only created while they are written
+    # If the PDB object has been unloaded, its file is read again when the
+    #  atoms are written and released right after, so only one model is
+    #  in memory at a time
+    # `restraint_fit` holds the (restraints, distances, satisfied) of the
+    #  restraints evaluated on the model, see `satisfaction.RestraintEvaluator`
     # ======================================================================
-    def __init__(self, assymetric_dic, atom_list, *args, **kwargs):
+    def __init__(self, assymetric_dic, pdb, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.asym_unit_map = assymetric_dic
-        self.atom_list = atom_list
+        self.pdb = pdb
+        self.restraint_fit = None
 
     def get_atoms(self):
-        for asym, seq_id, type_symbol, atom_id, x, y, z in self.atom_list:
+        pdb = self.pdb
+        stream = not pdb.is_loaded
+        if stream:
+            pdb.load()
+
+        try:
+            yield from self._get_atoms()
+        finally:
+            if stream:
+                pdb.unload()
+
+    def _get_atoms(self):
+        pdb = self.pdb
+        asym_list = [self.asym_unit_map[chain] for chain in pdb.chain_table]
+        for chain, seq_id, element, atom_id, (x, y, z) in zip(
+            pdb.chain_codes.tolist(),
+            pdb.seq_ids.tolist(),
+            pdb.element_codes.tolist(),
+            pdb.atom_id_codes.tolist(),
+            pdb.coords.tolist(),
+        ):
             yield ihm.model.Atom(
-                asym_unit=self.asym_unit_map[asym],
-                type_symbol=type_symbol,
+                asym_unit=asym_list[chain],
+                type_symbol=pdb.element_table[element],
                 seq_id=seq_id,
-                atom_id=atom_id,
+                atom_id=pdb.atom_id_table[atom_id],
                 x=x,
                 y=y,
                 z=z,
@@ -0,0 +1,54 @@
+import ihm.restraint
+
+
+class FeatureCache:
+    """Intern the ranges, residue and atom features used by the restraints.
+
+    The same residues recur across many restraints, so a single range is kept
+    per residue and a single feature per set of residues, which `ihm` then
+    writes only once.
+    """
+
+    def __init__(self, asym_dic):
+        self.asym_dic = asym_dic
+        self.range_dic = {}
+        self.feature_dic = {}
+
+    def get_range(self, segid, seq_id):
+        """Get the range of a single residue of an asymetric unit."""
+        key = (segid, seq_id)
+        rng = self.range_dic.get(key)
+        if rng is None:
+            rng = self.asym_dic[segid](seq_id, seq_id)
+            self.range_dic[key] = rng
+        return rng
+
+    def get_feature(self, residue_list):
+        """Get the feature of a list of (segid, seq_id) residues.
+
+        The features are shared between restraints and between their sides,
+        so they carry no details of their own.
+        """
+        # repeated residues do not change the feature
+        residue_list = list(dict.fromkeys(residue_list))
+        key = frozenset(residue_list)
+        feature = self.feature_dic.get(key)
+        if feature is None:
+            ranges = [self.get_range(segid, seq_id) for segid, seq_id in residue_list]
+            feature = ihm.restraint.ResidueFeature(ranges)
+            self.feature_dic[key] = feature
+        return feature
+
+    def get_atom_feature(self, atom_list):
+        """Get the feature of a list of (segid, seq_id, atom name) atoms."""
+        atom_list = list(dict.fromkeys(atom_list))
+        key = frozenset(atom_list)
+        feature = self.feature_dic.get(key)
+        if feature is None:
+            atoms = [
+                self.asym_dic[segid].residue(seq_id).atom(name)
+                for segid, seq_id, name in atom_list
+            ]
+            feature = ihm.restraint.AtomFeature(atoms)
+            self.feature_dic[key] = feature
+        return feature
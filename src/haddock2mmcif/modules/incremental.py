@@ -0,0 +1,64 @@
+import json
+import logging
+from pathlib import Path
+
+from haddock2mmcif.modules.utils import file_digest
+
+inclog = logging.getLogger("log")
+
+# Bump this when the layout of the manifest changes
+MANIFEST_VERSION = 4
+
+
+class RunManifest:
+    """Sidecar manifest of a conversion, written next to its output.
+
+    For each section of the output (models, ambiguous and unambiguous
+    restraints) it keeps the digest of the inputs the section was built from
+    and the results derived from them, so a later conversion can reuse the
+    sections whose inputs did not change.
+    """
+
+    def __init__(self, manifest_f):
+        self.manifest_f = Path(manifest_f)
+        self.previous = {}
+        self.section_dic = {}
+
+    def load(self):
+        """Read the manifest of the previous conversion, if there is one."""
+        try:
+            with open(self.manifest_f, "r") as fh:
+                manifest = json.load(fh)
+        except (OSError, ValueError):
+            return
+
+        if manifest.get("version") == MANIFEST_VERSION:
+            self.previous = manifest["sections"]
+
+    @staticmethod
+    def digest(path_list, **values):
+        """Get the digest of the input files, plus any other input values.
+
+        The files are keyed by name, so a run unpacked again from its archive
+        to another directory still matches.
+        """
+        digest_dic = {Path(path).name: file_digest(path) for path in path_list}
+        digest_dic.update({name: str(value) for name, value in values.items()})
+        return digest_dic
+
+    def get_results(self, section, inputs):
+        """Get the previous results of a section, `None` if its inputs changed."""
+        previous = self.previous.get(section)
+        if previous and previous["inputs"] == inputs:
+            inclog.info(f"Inputs of the {section} did not change, reusing them")
+            return previous["results"]
+        return None
+
+    def update(self, section, inputs, results):
+        self.section_dic[section] = {"inputs": inputs, "results": results}
+
+    def write(self):
+        manifest = {"version": MANIFEST_VERSION, "sections": self.section_dic}
+        inclog.info(f"Writing the manifest to {self.manifest_f}")
+        with open(self.manifest_f, "w") as fh:
+            json.dump(manifest, fh)
@@ -0,0 +1,18 @@
+import re
+
+# IMPORTANT: the metrics are checked while the arguments are parsed, this
+#  module must not import numpy, see `ranking` for how they are computed
+METRIC_REGEX = re.compile(r"top(\d+)|mean|median")
+
+
+def parse_metric(metric):
+    """Check a ranking metric, `topN` (mean of N first models), `mean` or `median`."""
+    match = METRIC_REGEX.fullmatch(metric)
+    if not match or match.group(1) == "0":
+        raise ValueError(f"Unknown ranking metric {metric!r}")
+    return metric
+
+
+def get_top(metric):
+    """Get the number of models averaged by a `topN` metric, 4 otherwise."""
+    return int(metric[3:]) if metric.startswith("top") else 4
@@ -0,0 +1,72 @@
+import gzip
+import logging
+import lzma
+from pathlib import Path
+
+outlog = logging.getLogger("log")
+
+# The output format and compression are chosen from the extensions of the
+#  output, `model.cif`, `model.bcif.gz`, `model.cif.xz`...
+FORMAT_EXTENSIONS = {"mmCIF": ".cif", "BCIF": ".bcif"}
+COMPRESSION_EXTENSIONS = {"gzip": ".gz", "xz": ".xz"}
+COMPRESSION_OPENERS = {"gzip": gzip.open, "xz": lzma.open}
+
+
+def parse_output_name(output_fname):
+    """Get the format and compression named by the extensions of an output.
+
+    Either is `None` if the extensions do not tell it.
+    """
+    output_format = compression = None
+    suffixes = Path(output_fname).suffixes
+    for name, extension in COMPRESSION_EXTENSIONS.items():
+        if suffixes and suffixes[-1] == extension:
+            compression = name
+            suffixes = suffixes[:-1]
+            break
+    for name, extension in FORMAT_EXTENSIONS.items():
+        if suffixes and suffixes[-1] == extension:
+            output_format = name
+            break
+    return output_format, compression
+
+
+def get_output_format(output_fname, output_format=None, compression=None):
+    """Get the format and compression of an output, if not given, from its name."""
+    name_format, name_compression = parse_output_name(output_fname)
+    if compression is None:
+        compression = name_compression
+    if output_format is None:
+        output_format = name_format or "mmCIF"
+
+    if output_format == "BCIF":
+        try:
+            import msgpack  # noqa: F401
+        except ImportError as err:
+            raise ImportError(
+                "Writing BinaryCIF needs the msgpack module, "
+                "install it with `pip install haddock2mmcif[bcif]`"
+            ) from err
+
+    return output_format, compression
+
+
+def get_output_extension(output_format="mmCIF", compression=None):
+    """Get the extension of an output in the given format and compression."""
+    extension = FORMAT_EXTENSIONS[output_format]
+    if compression:
+        extension += COMPRESSION_EXTENSIONS[compression]
+    return extension
+
+
+def open_output(output_fname, output_format="mmCIF", compression=None):
+    """Open an output for writing, compressing it on the fly if needed.
+
+    mmCIF is text while BinaryCIF is written in binary mode.
+    """
+    mode = "wb" if output_format == "BCIF" else "wt"
+    encoding = None if output_format == "BCIF" else "utf-8"
+    if compression:
+        outlog.info(f"Compressing the output with {compression}")
+        return COMPRESSION_OPENERS[compression](output_fname, mode, encoding=encoding)
+    return open(output_fname, mode, encoding=encoding)
@@ -0,0 +1,63 @@
+import re
+import logging
+from pathlib import Path
+
+paramlog = logging.getLogger("log")
+
+PARAM_REGEX = re.compile(r"{===>}\s*(\w+)\s*=\s*(.*?)\s*;")
+
+# HADDOCK numbers its stages in the name of the scoring weights, w_vdw_0 is
+#  the weight of the vdw term in it0
+STAGES = {"it0": 0, "it1": 1, "water": 2}
+
+
+def parse_value(value):
+    """Convert a run.cns value to a bool, int, float or str."""
+    if value.lower() in ("true", "false"):
+        return value.lower() == "true"
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    return value.strip('"')
+
+
+class RunParameters:
+    """The parameters of a run, read from its run.cns in a single pass."""
+
+    def __init__(self, run_cns):
+        self.run_cns = Path(run_cns)
+        self.param_dic = {}
+
+    def load(self):
+        with open(self.run_cns, "r") as fh:
+            for line in fh:
+                for match in PARAM_REGEX.finditer(line):
+                    name, value = match.groups()
+                    self.param_dic[name] = parse_value(value)
+
+    def get(self, name, default=None):
+        return self.param_dic.get(name, default)
+
+    @property
+    def noecv(self) -> bool:
+        return self.get("noecv") is True
+
+    @property
+    def ncvpart(self) -> float:
+        return float(self.get("ncvpart", 0.0))
+
+    @property
+    def flcut(self) -> float:
+        return float(self.get("flcut", 5.0))
+
+    def get_scoring_weights(self, stage="water"):
+        """Get the weight of each scoring term of a stage, `{"vdw": 1.0, ...}`."""
+        suffix = f"_{STAGES[stage]}"
+        weight_dic = {}
+        for name, value in self.param_dic.items():
+            if name.startswith("w_") and name.endswith(suffix):
+                term = name[len("w_") : -len(suffix)]
+                weight_dic[term] = float(value)
+        return weight_dic
@@ -1,8 +1,9 @@
+import itertools
 from pathlib import Path
-import subprocess
-import shlex
-import os
-from haddock2mmcif.modules.utils import backmap
+
+import numpy as np
+
+from haddock2mmcif.modules.contacts import find_contacts, is_hydrogen
 
 AA_DICTIONARY = {
     "CYS": "C",
@@ -28,76 +29,230 @@ AA_DICTIONARY = {
 }
 
 
-TOOL_PATH = Path(Path(__file__).parents[3], "tools")
+def list_to_range(lst):
+    """Convert a list of residues to sorted contiguous ranges."""
+    # thanks: https://stackoverflow.com/a/4629241
+    for a, b in itertools.groupby(
+        enumerate(sorted(lst)), lambda pair: pair[1] - pair[0]
+    ):
+        b = list(b)
+        yield b[0][1], b[-1][1]
+
+
+# Width of the fixed-column ATOM records, shorter lines are padded with spaces
+RECORD_WIDTH = 80
+
+
+def encode(values):
+    """Encode values as integer codes, in order of first appearance.
+
+    Returns the codes and the table of unique values, so that
+     `table[codes[i]] == values[i]`.
+    """
+    table, first_idx, inverse = np.unique(
+        values, return_index=True, return_inverse=True
+    )
+    order = np.argsort(first_idx, kind="stable")
+    remap = np.empty(len(order), dtype=np.uint16)
+    remap[order] = np.arange(len(order))
+    return remap[inverse.ravel()], table[order]
+
+
+def read_records(buffer, record=b"ATOM"):
+    """Get the lines of a record as a (n, RECORD_WIDTH) array of bytes."""
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    if not len(data):
+        return np.empty((0, RECORD_WIDTH), dtype=np.uint8)
+
+    line_end = np.flatnonzero(data == ord("\n"))
+    if data[-1] != ord("\n"):
+        line_end = np.append(line_end, len(data))
+    line_start = np.concatenate([[0], line_end[:-1] + 1])
+
+    # only the lines that start with the record name
+    prefix = np.frombuffer(record, dtype=np.uint8)
+    is_record = line_end - line_start >= len(prefix)
+    for i, char in enumerate(prefix):
+        is_record &= data[np.minimum(line_start + i, len(data) - 1)] == char
+    line_start, line_end = line_start[is_record], line_end[is_record]
+
+    # take RECORD_WIDTH bytes from the start of each line, the bytes past the
+    #  end of a line are replaced by spaces
+    padded = np.concatenate([data, np.full(RECORD_WIDTH, ord(" "), dtype=np.uint8)])
+    windows = np.lib.stride_tricks.sliding_window_view(padded, RECORD_WIDTH)
+    past_end = np.arange(RECORD_WIDTH) >= (line_end - line_start)[:, None]
+    return np.where(past_end, np.uint8(ord(" ")), windows[line_start])
+
+
+def get_field(records, start, end):
+    """Slice a fixed-column field out of the records, as an array of bytes."""
+    field = np.ascontiguousarray(records[:, start:end])
+    return field.view(f"S{end - start}").ravel()
 
 
 class PDB:
+    # ======================================================================
+    # IMPORTANT #
+    # The atoms are stored as columns instead of one tuple per atom, the
+    #  coordinates as float32 and the seq_ids as integers. The chain, element
+    #  and atom names are stored as integer codes that index the `*_table`
+    #  lists, for example `self.chain_table[self.chain_codes[0]]` is the chain
+    #  of the first atom.
+    # ======================================================================
     def __init__(self, pdb_f):
         self.pdb_file = Path(pdb_f)
-        self.atom_list = []
+        self.coords = np.empty((0, 3), dtype=np.float32)
+        self.seq_ids = np.empty(0, dtype=np.int32)
+        self.chain_codes = np.empty(0, dtype=np.uint16)
+        self.element_codes = np.empty(0, dtype=np.uint16)
+        self.atom_id_codes = np.empty(0, dtype=np.uint16)
+        self.chain_table = []
+        self.element_table = []
+        self.atom_id_table = []
         self.seq_dic = {}
         self.map_dic = {}
+        self.seq_id_dic = {}
         self.interface_dic = {}
 
+    @property
+    def is_loaded(self):
+        return len(self.coords) > 0
+
+    def unload(self):
+        """Release the atoms, keeping the sequence, mapping and interface."""
+        self.coords = np.empty((0, 3), dtype=np.float32)
+        self.seq_ids = np.empty(0, dtype=np.int32)
+        self.chain_codes = np.empty(0, dtype=np.uint16)
+        self.element_codes = np.empty(0, dtype=np.uint16)
+        self.atom_id_codes = np.empty(0, dtype=np.uint16)
+        self.chain_table = []
+        self.element_table = []
+        self.atom_id_table = []
+
     def load(self):
-        pdb_dic = {}
-        seq_id = 0
-        with open(self.pdb_file) as fh:
-            for line in fh.readlines():
-                if line.startswith("ATOM"):
-                    atom_id = line[12:16].strip()
-                    chain = line[21]
-                    resname = line[17:20]
-                    resnum = int(line[22:26])
-                    x = float(line[30:38])
-                    y = float(line[38:46])
-                    z = float(line[46:54])
-                    element = line[77:79].strip()
-                    if chain not in pdb_dic:
-                        pdb_dic[chain] = {}
-                        self.map_dic[chain] = {}
-                        seq_id = 0
-
-                    if resnum not in pdb_dic[chain]:
-                        pdb_dic[chain][resnum] = resname
-                        seq_id += 1  # this needs to be before the assign below
-                        self.map_dic[chain][seq_id] = resnum
-                        # self.map_dic[chain][resnum] = seq_id
-
-                    atom_data = chain, seq_id, element, atom_id, x, y, z
-                    self.atom_list.append(atom_data)
-
-        for chain in pdb_dic:
+        """Read the ATOM records of the file."""
+        with open(self.pdb_file, "rb") as fh:
+            self.parse(fh.read())
+
+    def parse(self, buffer):
+        """Parse the ATOM records of a PDB, all fields are converted in bulk."""
+        records = read_records(buffer)
+
+        chains = get_field(records, 21, 22)
+        resnames = get_field(records, 17, 20)
+        resnums = get_field(records, 22, 26).astype(np.int64)
+        atom_ids = np.char.strip(get_field(records, 12, 16))
+        elements = np.char.strip(get_field(records, 77, 79))
+        self.coords = np.stack(
+            [
+                get_field(records, 30, 38).astype(np.float32),
+                get_field(records, 38, 46).astype(np.float32),
+                get_field(records, 46, 54).astype(np.float32),
+            ],
+            axis=1,
+        )
+
+        self.chain_codes, chain_table = encode(chains)
+        self.element_codes, element_table = encode(elements)
+        self.atom_id_codes, atom_id_table = encode(atom_ids)
+        self.chain_table = [chain.decode() for chain in chain_table]
+        self.element_table = [element.decode() for element in element_table]
+        self.atom_id_table = [atom_id.decode() for atom_id in atom_id_table]
+
+        # the residues of each chain are numbered from 1 in order of appearance
+        residue_keys = (self.chain_codes.astype(np.int64) << 32) + (resnums + (1 << 31))
+        _, first_idx, residue_idx = np.unique(
+            residue_keys, return_index=True, return_inverse=True
+        )
+        order = np.lexsort((first_idx, self.chain_codes[first_idx]))
+        residue_chains = self.chain_codes[first_idx[order]]
+        chain_start = np.searchsorted(residue_chains, residue_chains, side="left")
+        seq_id_list = np.empty(len(order), dtype=np.int32)
+        seq_id_list[order] = np.arange(len(order)) - chain_start + 1
+        self.seq_ids = seq_id_list[residue_idx.ravel()]
+
+        self.seq_dic = {}
+        self.map_dic = {}
+        self.seq_id_dic = {}
+        for chain in self.chain_table:
             self.seq_dic[chain] = []
-            for three_letter_res in pdb_dic[chain].values():
-                try:
-                    one_letter_res = AA_DICTIONARY[three_letter_res]
-                except KeyError:
-                    # this aminoacid is not in the dictionary,
-                    #  overwrite for now
-                    one_letter_res = "A"
-                self.seq_dic[chain].append(one_letter_res)
+            self.map_dic[chain] = {}
+            self.seq_id_dic[chain] = {}
+
+        residue_first = first_idx[order]
+        for chain_code, seq_id, resnum, resname in zip(
+            self.chain_codes[residue_first].tolist(),
+            self.seq_ids[residue_first].tolist(),
+            resnums[residue_first].tolist(),
+            resnames[residue_first].tolist(),
+        ):
+            chain = self.chain_table[chain_code]
+            self.map_dic[chain][seq_id] = resnum
+            self.seq_id_dic[chain][resnum] = seq_id
+
+            three_letter_res = resname.decode()
+            try:
+                one_letter_res = AA_DICTIONARY[three_letter_res]
+            except KeyError:
+                # this aminoacid is not in the dictionary,
+                #  overwrite for now
+                one_letter_res = "A"
+            self.seq_dic[chain].append(one_letter_res)
 
     def get_interface(self, cutoff=5.0):
-        cmd = f"{TOOL_PATH}/contact-chainID {self.pdb_file} {cutoff}"
-        out = subprocess.check_output(shlex.split(cmd))  # nosec
-        for line in out.decode("utf-8").split(os.linesep):
-            data = line.split()
-            if data:
-                res_a, chain_a, _, res_b, chain_b, _, _ = data
-                res_a = int(res_a)
-                res_b = int(res_b)
-
-                if chain_a not in self.interface_dic:
-                    self.interface_dic[chain_a] = []
-
-                if chain_b not in self.interface_dic:
-                    self.interface_dic[chain_b] = []
-
-                mapped_res_a = backmap(self.map_dic[chain_a], res_a)
-                if mapped_res_a not in self.interface_dic[chain_a]:
-                    self.interface_dic[chain_a].append(mapped_res_a)
-
-                mapped_res_b = backmap(self.map_dic[chain_b], res_b)
-                if mapped_res_b not in self.interface_dic[chain_b]:
-                    self.interface_dic[chain_b].append(mapped_res_b)
+        """Find the residues of each chain in contact with another chain."""
+        for chain, residues in self.get_interface_sweep([cutoff])[cutoff].items():
+            self.interface_dic.setdefault(chain, set()).update(residues)
+
+    def get_interface_sweep(self, cutoffs):
+        """Find the interface residues of each chain at several cutoffs at once.
+
+        A single neighbor search is done at the largest cutoff, each residue
+        keeps its closest contact, which then tells the cutoffs it is within.
+        Returns `{cutoff: {chain: set of seq_ids}}`, the interface is not stored.
+        """
+        if not cutoffs:
+            return {}
+
+        # hydrogens are not taken into account for the contacts
+        heavy = ~is_hydrogen(self.atom_id_table)[self.atom_id_codes]
+        chain_codes = self.chain_codes[heavy]
+        seq_ids = self.seq_ids[heavy]
+        coords = self.coords[heavy]
+
+        max_cutoff = max(cutoffs)
+        pair_i, pair_j, pair_dist = find_contacts(coords, chain_codes, max_cutoff)
+        contact_idx = np.concatenate([pair_i, pair_j])
+        contact_dist = np.concatenate([pair_dist, pair_dist])
+
+        # the closest contact of each residue
+        contact_chains = chain_codes[contact_idx].astype(np.int64)
+        residue_keys = (contact_chains << 32) + seq_ids[contact_idx]
+        residue_keys, residue_idx = np.unique(residue_keys, return_inverse=True)
+        min_dist = np.full(len(residue_keys), np.inf)
+        np.minimum.at(min_dist, residue_idx.ravel(), contact_dist)
+        residue_chains = residue_keys >> 32
+        residue_seq_ids = residue_keys & 0xFFFFFFFF
+
+        sweep_dic = {}
+        for cutoff in cutoffs:
+            # all the contacts found are within the search cutoff
+            if cutoff < max_cutoff:
+                within = min_dist < cutoff
+            else:
+                within = np.ones(len(min_dist), dtype=bool)
+
+            interface_dic = {}
+            for code, chain in enumerate(self.chain_table):
+                in_chain = within & (residue_chains == code)
+                if in_chain.any():
+                    interface_dic[chain] = set(residue_seq_ids[in_chain].tolist())
+            sweep_dic[cutoff] = interface_dic
+        return sweep_dic
+
+    def get_interface_ranges(self):
+        """Summarize the interface of each chain as sorted contiguous ranges."""
+        return {
+            chain: list(list_to_range(residues))
+            for chain, residues in self.interface_dic.items()
+        }
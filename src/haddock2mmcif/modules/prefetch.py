@@ -0,0 +1,61 @@
+import asyncio
+import logging
+
+prefetchlog = logging.getLogger("log")
+
+
+def read_file(path):
+    with open(path, "rb") as fh:
+        return fh.read()
+
+
+async def prefetch(path_list, depth=4):
+    """Yield the `(path, contents)` of the files, in order, reading ahead.
+
+    The next `depth` files are read in background threads while the current
+    one is processed, the bounded queue keeps at most that many in memory.
+    """
+    queue = asyncio.Queue(maxsize=depth)
+
+    async def read_ahead():
+        for path in path_list:
+            # the read starts right away, the queue holds the pending reads
+            read = asyncio.ensure_future(asyncio.to_thread(read_file, path))
+            await queue.put(read)
+
+    producer = asyncio.create_task(read_ahead())
+    try:
+        for path in path_list:
+            read = await queue.get()
+            yield path, await read
+    finally:
+        producer.cancel()
+
+
+def is_loop_running():
+    """Check if this thread already runs an event loop, as in Jupyter."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def map_prefetched(func, path_list, depth=4):
+    """Call `func(path, data=contents)` on each file while the next are read.
+
+    Inside a running event loop, which `asyncio.run` cannot be called from,
+    the files are read by `func` itself, one after the other.
+    """
+    if is_loop_running():
+        prefetchlog.info("An event loop is already running, not reading ahead")
+        return [func(path) for path in path_list]
+
+    async def run():
+        return [
+            func(path, data=contents)
+            async for path, contents in prefetch(path_list, depth)
+        ]
+
+    prefetchlog.info(f"Reading up to {depth} models ahead")
+    return asyncio.run(run())
@@ -0,0 +1,89 @@
+import json
+import logging
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # POSIX only, there is no peak RSS on Windows
+    resource = None
+
+proflog = logging.getLogger("log")
+
+# ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+def get_max_rss():
+    """Get the peak RSS of this process so far, in bytes, `None` if unknown."""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RSS_UNIT
+
+
+def snapshot():
+    """Get the current wall and CPU times and the peak RSS of this process."""
+    return time.perf_counter(), time.process_time(), get_max_rss()
+
+
+def usage_since(start):
+    """Get the resources used since a snapshot.
+
+    The peak RSS can only be read for the whole process, so it is reported
+    as the peak so far (`max_rss_mb`), and how much it grew since the
+    snapshot (`max_rss_growth_mb`), which is zero unless this was the most
+    memory-hungry part of the process yet.
+    """
+    wall, cpu, max_rss = snapshot()
+    return {
+        "wall_time": wall - start[0],
+        "cpu_time": cpu - start[1],
+        "max_rss_mb": None if max_rss is None else max_rss / 1024 / 1024,
+        "max_rss_growth_mb": (
+            None if max_rss is None else (max_rss - start[2]) / 1024 / 1024
+        ),
+    }
+
+
+def measure(func, *args, **kwargs):
+    """Call a function, returning its result and the resources it used.
+
+    This is a plain function so it can be sent to worker processes.
+    """
+    start = snapshot()
+    result = func(*args, **kwargs)
+    return result, usage_since(start)
+
+
+class Profiler:
+    """Record the resources used by each stage of a conversion and each model."""
+
+    def __init__(self):
+        self.stage_list = []
+        self.model_list = []
+        self.start = snapshot()
+
+    @contextmanager
+    def stage(self, name):
+        start = snapshot()
+        try:
+            yield
+        finally:
+            self.stage_list.append({"stage": name, **usage_since(start)})
+
+    def add_model(self, name, usage):
+        self.model_list.append({"model": name, **usage})
+
+    def write(self, report_f, **metadata):
+        """Write the report as JSON, with any extra metadata at its top."""
+        report = {
+            **metadata,
+            "total": usage_since(self.start),
+            "stages": self.stage_list,
+            "models": self.model_list,
+        }
+        proflog.info(f"Writing the profile report to {report_f}")
+        with open(report_f, "w") as fh:
+            json.dump(report, fh, indent=2)
@@ -0,0 +1,100 @@
+import logging
+import re
+
+import numpy as np
+
+rankinglog = logging.getLogger("log")
+
+# Each line of a file.list ends with the score of a model, `... { -123.4 }`,
+#  the model index is the line number and lines without a score are empty
+SCORE_REGEX = re.compile(r"^[^{\n]*(?:{\s(-?\d*.?\d*)\s})?.*$", re.MULTILINE)
+CLUSTER_REGEX = re.compile(r"Cluster\s(\d+)\s->\s\d+\s(.*)")
+
+
+def read_scores(file_list):
+    """Read the score of each model of a file.list, NaN for the lines without one."""
+    with open(file_list, "r") as fh:
+        text = fh.read()
+
+    # the empty match after the last line break is not a line
+    fields = SCORE_REGEX.findall(text.removesuffix("\n"))
+    return np.fromiter(
+        (float(field) if field else np.nan for field in fields),
+        dtype=np.float64,
+        count=len(fields),
+    )
+
+
+def read_clusters(cluster_out):
+    """Read the models of each cluster of a cluster.out, in their order."""
+    cluster_dic = {}
+    with open(cluster_out, "r") as fh:
+        for line in fh:
+            match = CLUSTER_REGEX.search(line)
+            if match and match.group(2).split():
+                cluster_name = int(match.group(1))
+                cluster_dic[cluster_name] = np.array(
+                    match.group(2).split(), dtype=np.int64
+                )
+    return cluster_dic
+
+
+def get_cluster_stats(cluster_dic, scores, top=4):
+    """Get the score statistics of each cluster.
+
+    `top_mean` is the mean score of the `top` first models of the cluster,
+    as listed in the cluster.out.
+    """
+    if not cluster_dic:
+        return {}
+
+    # IMPORTANT: the scores of all the clusters are gathered in a single array,
+    #  the statistics are computed per segment of it
+    sizes = np.array([len(members) for members in cluster_dic.values()])
+    members = np.concatenate(list(cluster_dic.values()))
+    if members.min() < 0 or members.max() >= len(scores):
+        raise ValueError("The clusters refer to models that are not in the file.list")
+    member_scores = scores[members]
+    if np.isnan(member_scores).any():
+        model = members[np.isnan(member_scores)][0]
+        raise ValueError(f"No score in the file.list for model {model}")
+
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    cluster_idx = np.repeat(np.arange(len(sizes)), sizes)
+    means = np.add.reduceat(member_scores, starts) / sizes
+    stds = np.sqrt(
+        np.add.reduceat((member_scores - means[cluster_idx]) ** 2, starts) / sizes
+    )
+
+    # the first `top` models of each cluster, padded with its last one
+    n_top = np.minimum(sizes, top)
+    top_range = np.arange(top)[None, :]
+    top_idx = starts[:, None] + np.minimum(top_range, n_top[:, None] - 1)
+    top_mask = top_range < n_top[:, None]
+    top_means = np.where(top_mask, member_scores[top_idx], 0).sum(axis=1) / n_top
+
+    # the scores sorted within each cluster give the best and the median
+    sorted_scores = member_scores[np.lexsort((member_scores, cluster_idx))]
+    bests = sorted_scores[starts]
+    medians = (
+        sorted_scores[starts + (sizes - 1) // 2] + sorted_scores[starts + sizes // 2]
+    ) / 2
+
+    stats_dic = {}
+    for i, cluster_name in enumerate(cluster_dic):
+        stats_dic[cluster_name] = {
+            "size": int(sizes[i]),
+            "top_mean": float(top_means[i]),
+            "mean": float(means[i]),
+            "median": float(medians[i]),
+            "std": float(stds[i]),
+            "best": float(bests[i]),
+        }
+    return stats_dic
+
+
+def get_ranking(stats_dic, metric="top4"):
+    """Rank the clusters by a metric, the lowest score first."""
+    key = "top_mean" if metric.startswith("top") else metric
+    ranked = sorted(stats_dic, key=lambda cluster_name: stats_dic[cluster_name][key])
+    return {ranking + 1: cluster_name for ranking, cluster_name in enumerate(ranked)}
@@ -1,36 +1,282 @@
 import re
 import logging
+from collections import namedtuple
+from functools import partial
 
 restlog = logging.getLogger("log")
 
+# A restraint of a .tbl, each selection is a list of (resid, segid), and the
+#  atoms a list of the atom name of each of them, `None` for the whole residue
+TblRecord = namedtuple(
+    "TblRecord",
+    ["selection_i", "selection_j", "distance", "lower", "upper", "atoms_i", "atoms_j"],
+    defaults=(None, None),
+)
+
+
+class UnsupportedSelectionError(ValueError):
+    """A valid selection the restraints cannot be built from, such as `not`."""
+
+
+TOKEN_REGEX = re.compile(r"[()]|[^\s()]+")
+STATEMENT_REGEX = re.compile(r"assi", re.IGNORECASE)
+# `assign` can be abbreviated down to its first four letters
+KEYWORD_REGEX = re.compile(r"assi(?:gn?)?\b", re.IGNORECASE)
+# the attributes taking a value, which can be spelled as a keyword
+VALUE_REGEX = re.compile(r"segid?|resid?|resn\w*|name|chem\w*|atom", re.IGNORECASE)
+COMMENT_REGEX = re.compile(r"!.*")
+BLOCK_COMMENT_REGEX = re.compile(r"\{[^}]*\}")
+
+# The characters of the CNS atom name patterns
+WILDCARDS = "*%#+"
+
+# The restraints of HADDOCK tables select whole residues, `assign (sel) (sel
+# or sel ...) d d- d+`, these are matched in one go by the regexes below and
+# anything else goes through the tokenizer
+RESIDUE_REGEX = re.compile(r"\(\s*resid\s+(-?\d+)\s+and\s+segid\s+(\w+)\s*\)")
+_RESIDUE = r"\(\s*resid\s+-?\d+\s+and\s+segid\s+\w+\s*\)"
+SIMPLE_REGEX = re.compile(
+    rf"\s*assign\s*{_RESIDUE}\s*"
+    rf"(?:{_RESIDUE}|\(\s*{_RESIDUE}(?:\s*or\s*{_RESIDUE})*\s*\))"
+    r"\s*(\S+)\s+(\S+)\s+(\S+)\s*"
+)
+
+
+def strip_comments(text):
+    """Remove the `!` and `{ }` comments, keeping the line breaks."""
+    text = COMMENT_REGEX.sub("", text)
+    if "{" in text:
+        text = BLOCK_COMMENT_REGEX.sub(lambda m: "\n" * m.group().count("\n"), text)
+    return text
+
+
+def is_statement_start(text, pos):
+    """Check if the `assi` found at `pos` is the keyword of an `assign` statement.
+
+    The keyword is a whole word, `assign` or its abbreviations, and not the
+    value of an attribute, as in `segid ASSI`.
+    """
+    if pos and (text[pos - 1].isalnum() or text[pos - 1] == "_"):
+        return False
+    if not KEYWORD_REGEX.match(text, pos):
+        return False
+    # the word before the keyword, usually the last number of a restraint
+    before = text[max(0, pos - 32) : pos].rstrip()
+    if not before[-1:].isalpha():
+        return True
+    return not VALUE_REGEX.fullmatch(before.split()[-1].lstrip("("))
+
+
+def split_statements(text):
+    """Split a text before each `assign` keyword.
+
+    Looking for the keyword with str.split is much faster than with the
+    regex, the text only has to be lowercased first.
+    """
+    if text.isascii():
+        pos_list = []
+        pos = 0
+        for piece in text.lower().split("assi")[:-1]:
+            pos += len(piece)
+            pos_list.append(pos)
+            pos += 4
+    else:
+        # lowercasing may change the length of the text
+        pos_list = [match.start() for match in STATEMENT_REGEX.finditer(text)]
+
+    statement_list = []
+    start = 0
+    for pos in pos_list:
+        if is_statement_start(text, pos):
+            statement_list.append(text[start:pos])
+            start = pos
+    statement_list.append(text[start:])
+    return statement_list
+
+
+def iter_statements(fh, chunk_size=1 << 20):
+    """Split a CNS restraint table in `assign` statements, streaming it by chunks.
+
+    Yields the text of each statement without its comments, together with
+    the line it starts at.
+    """
+    line_number = 1
+    pending = ""
+    for chunk in iter(partial(fh.read, chunk_size), ""):
+        # only whole lines are split, the rest waits for the next chunk
+        pending += chunk
+        cut = pending.rfind("\n") + 1
+        text, pending = strip_comments(pending[:cut]), pending[cut:]
+        if "{" in text:
+            # a block comment that is not closed yet
+            start = text.index("{")
+            text, pending = text[:start], text[start:] + pending
+
+        statement_list = split_statements(text)
+        # the last statement may continue in the next chunk
+        pending = statement_list.pop() + pending
+        for statement in statement_list:
+            if statement:
+                yield statement, line_number
+                line_number += statement.count("\n")
+
+    text = strip_comments(pending)
+    for statement in split_statements(text):
+        if statement:
+            yield statement, line_number
+            line_number += statement.count("\n")
+
+
+def _merge(value_a, value_b):
+    return value_a if value_a is not None else value_b
+
+
+def _parse_or(tokens, pos):
+    alternatives, pos = _parse_and(tokens, pos)
+    while tokens[pos].lower() == "or":
+        more, pos = _parse_and(tokens, pos + 1)
+        alternatives = alternatives + more
+    return alternatives, pos
+
+
+def _parse_and(tokens, pos):
+    alternatives, pos = _parse_factor(tokens, pos)
+    while tokens[pos].lower() == "and":
+        more, pos = _parse_factor(tokens, pos + 1)
+        alternatives = [
+            (_merge(resid_a, resid_b), _merge(segid_a, segid_b), _merge(name_a, name_b))
+            for resid_a, segid_a, name_a in alternatives
+            for resid_b, segid_b, name_b in more
+        ]
+    return alternatives, pos
+
+
+def _parse_factor(tokens, pos):
+    """Parse a term of a selection into a list of (resid, segid, name) alternatives.
+
+    Attributes other than resid, segid and name do not narrow the atoms
+    selected and are skipped.
+    """
+    token = tokens[pos]
+    if token == "(":
+        alternatives, pos = _parse_or(tokens, pos + 1)
+        if tokens[pos] != ")":
+            raise ValueError(f"expected ')' but found {tokens[pos]!r}")
+        return alternatives, pos + 1
+
+    keyword = token.lower()
+    value = tokens[pos + 1]
+    if keyword == "resid":
+        # `resid 10:12` selects a range of residues
+        if ":" in value:
+            start, end = value.split(":")
+            resid_range = range(int(start), int(end) + 1)
+            return [(resid, None, None) for resid in resid_range], pos + 2
+        return [(int(value), None, None)], pos + 2
+    if keyword == "segid":
+        return [(None, value, None)], pos + 2
+    if keyword == "name":
+        return [(None, None, value.upper())], pos + 2
+    if keyword == "not":
+        raise UnsupportedSelectionError(f"unsupported selection {token!r}")
+    if keyword in ("or", "and", ")"):
+        raise ValueError(f"unexpected {token!r}")
+    return [(None, None, None)], pos + 2
+
+
+def parse_selection(tokens, pos):
+    """Parse a parenthesized selection into a list of (resid, segid), and atoms."""
+    if tokens[pos] != "(":
+        raise ValueError(f"expected '(' but found {tokens[pos]!r}")
+    alternatives, pos = _parse_factor(tokens, pos)
+    for resid, _, _ in alternatives:
+        if resid is None:
+            raise ValueError("selection without a resid")
+    selection = [(resid, segid or "") for resid, segid, _ in alternatives]
+    atoms = [name for _, _, name in alternatives]
+    return selection, atoms, pos
+
+
+def parse_statement(statement):
+    """Parse an `assign` statement into a restraint record."""
+    match = SIMPLE_REGEX.fullmatch(statement)
+    if match:
+        distance, lower, upper = match.groups()
+        # the first residue is the only one of the first selection
+        residue_list = [
+            (int(resid), segid) for resid, segid in RESIDUE_REGEX.findall(statement)
+        ]
+        return TblRecord(
+            residue_list[:1],
+            residue_list[1:],
+            float(distance),
+            float(lower),
+            float(upper),
+        )
+
+    # a sentinel, so the parser can always look one token ahead
+    tokens = TOKEN_REGEX.findall(statement) + [""]
+    selection_i, atoms_i, pos = parse_selection(tokens, 1)
+    selection_j, atoms_j, pos = parse_selection(tokens, pos)
+    distance, lower, upper = map(float, tokens[pos : pos + 3])
+    return TblRecord(selection_i, selection_j, distance, lower, upper, atoms_i, atoms_j)
+
+
+def parse_tbl(tbl_file):
+    """Parse the `assign` statements of a CNS restraint table, one at a time."""
+    with open(tbl_file, "r") as fh:
+        for statement, line_number in iter_statements(fh):
+            if statement.lstrip()[:4].lower() != "assi":
+                # anything before the first assign
+                continue
+            try:
+                yield parse_statement(statement)
+            except UnsupportedSelectionError as err:
+                restlog.warning(f"{tbl_file}:{line_number}: skipping restraint ({err})")
+            except (IndexError, ValueError) as err:
+                raise ValueError(
+                    f"{tbl_file}:{line_number}: invalid restraint ({err})"
+                ) from err
+
+
+def get_restraint_side(selection, atoms):
+    """Get the (resid, segid, name) of the atoms selected by a side of a restraint.
+
+    A `None` name is the whole residue, as are the CNS wildcards (`name H*`),
+    which can only be told apart from the atoms of the models.
+    """
+    if atoms is None:
+        return [(resid, segid, None) for resid, segid in selection]
+    side = [
+        (resid, segid, None if name is None or set(name) & set(WILDCARDS) else name)
+        for (resid, segid), name in zip(selection, atoms)
+    ]
+    return list(dict.fromkeys(side))
+
 
 class UnambigRestraint:
+    # ======================================================================
+    # IMPORTANT #
+    # Each restraint is a tuple of (side_i, side_j, distance, lower, upper),
+    #  each side is the list of (resid, segid, name) it selects, the resids
+    #  are numbered as in the .tbl and the name is `None` for the whole
+    #  residue, an `or` or a range of resids selects several of them.
+    # ======================================================================
     def __init__(self, tbl_file):
         self.tbl_file = tbl_file
         self.tbl_list = []
 
     def load(self):
         """Load the unambiguous restraints."""
-        resid_regex = r"resid\s(\d*)"
-        segid_regex = r"segid\s*(\w*)"
-        distances_regex = r"(\d*.?\d*)\s(\d*.?\d*)\s(\d*.?\d*)$"
-        with open(self.tbl_file, "r") as fh:
-            for line in fh.readlines():
-                if line.startswith("assign"):
-                    res_i, res_j = re.findall(resid_regex, line)
-                    segid_i, segid_j = re.findall(segid_regex, line)
-                    distances = re.findall(distances_regex, line)[0]
-                    distance, lower_bound, upper_bound = distances
-                    restraint = (
-                        int(res_i),
-                        segid_i,
-                        int(res_j),
-                        segid_j,
-                        float(distance),
-                        float(lower_bound),
-                        float(upper_bound),
-                    )
-                    self.tbl_list.append(restraint)
+        for record in parse_tbl(self.tbl_file):
+            restraint = (
+                get_restraint_side(record.selection_i, record.atoms_i),
+                get_restraint_side(record.selection_j, record.atoms_j),
+                record.distance,
+                record.lower,
+                record.upper,
+            )
+            self.tbl_list.append(restraint)
 
 
 class AmbigRestraint:
@@ -40,22 +286,6 @@ class AmbigRestraint:
 
     def load(self):
         """Load the ambig restraints."""
-        tbl_regex = r"resid\s*(\d*).*segid\s*(\w*)"
-        with open(self.tbl_file, "r") as fh:
-            for line in fh.readlines():
-                if line.startswith("assign"):
-                    # this is a special line
-                    # do something special
-                    match = re.search(tbl_regex, line)
-                    active_res = int(match.group(1))
-                    active_segid = str(match.group(2))
-                    active = (active_res, active_segid)
-                    self.tbl_dic[active] = []
-                else:
-                    # can be a valid line or not
-                    match = re.search(tbl_regex, line)
-                    if match:
-                        pas_res = int(match.group(1))
-                        pas_segid = str(match.group(2))
-                        passive = (pas_res, pas_segid)
-                        self.tbl_dic[active].append(passive)
+        for record in parse_tbl(self.tbl_file):
+            for active in record.selection_i:
+                self.tbl_dic[active] = record.selection_j
@@ -0,0 +1,133 @@
+import logging
+import os
+import re
+from pathlib import Path
+
+indexlog = logging.getLogger("log")
+
+CLUSTER_MODEL_REGEX = re.compile(r"cluster(\d+)_\d+\.pdb")
+
+# The inputs of a conversion, by the directory they are in relative to the run
+#  directory, the cluster models are matched by CLUSTER_MODEL_REGEX instead
+RUN_INPUTS = {
+    "run_cns": ("", "run.cns"),
+    "complex_pdb": ("begin", "complex_1.pdb"),
+    "file_list": ("structures/it1/water", "file.list"),
+    "cluster_out": ("structures/it1/water/analysis", "cluster.out"),
+    "ambig_tbl": ("data/distances", "ambig.tbl"),
+    "unambig_tbl": ("data/distances", "unambig.tbl"),
+}
+
+# A run can have no restraints of a kind, its table is then empty
+MAY_BE_EMPTY = ("ambig_tbl", "unambig_tbl")
+
+
+class RunIndex:
+    # ======================================================================
+    # IMPORTANT #
+    # The inputs of a conversion are found in a single pass, each directory
+    #  that holds one of them is listed once, and the sizes come with the
+    #  listing. A broken run is reported before anything is read, and
+    #  checking a run does not need `ihm`.
+    # ======================================================================
+    def __init__(self, rundir):
+        self.rundir = Path(rundir)
+        self.run_cns = None
+        self.complex_pdb = None
+        self.file_list = None
+        self.cluster_out = None
+        self.ambig_tbl = None
+        self.unambig_tbl = None
+        self.cluster_models = {}
+        self.size_dic = {}
+
+    def scan(self):
+        """List the directories of the run, recording the inputs found."""
+        dir_dic = {}
+        for name, (subdir, fname) in RUN_INPUTS.items():
+            dir_dic.setdefault(subdir, {})[fname] = name
+
+        for subdir, fname_dic in dir_dic.items():
+            try:
+                entries = list(os.scandir(Path(self.rundir, subdir)))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                name = fname_dic.get(entry.name)
+                if name:
+                    setattr(self, name, Path(entry.path))
+                    self.size_dic[name] = entry.stat().st_size
+                elif subdir == "":
+                    self.add_model(entry.name, Path(entry.path))
+
+        self.sort_models()
+        return self
+
+    def add_members(self, member_list):
+        """Record the inputs among the `(path, size)` of the files of the run.
+
+        The paths are relative to the run directory, as listed in a run
+        archive, so an archive is indexed without unpacking it.
+        """
+        input_dic = {
+            Path(subdir, fname): name for name, (subdir, fname) in RUN_INPUTS.items()
+        }
+        for member_name, size in member_list:
+            member_f = Path(member_name)
+            name = input_dic.get(member_f)
+            if name:
+                setattr(self, name, Path(self.rundir, member_f))
+                self.size_dic[name] = size
+            elif member_f.parent == Path(""):
+                self.add_model(member_f.name, Path(self.rundir, member_f))
+
+        self.sort_models()
+        return self
+
+    def add_model(self, fname, model_f):
+        """Record a clusterN_M.pdb model of the run directory."""
+        match = CLUSTER_MODEL_REGEX.fullmatch(fname)
+        if match:
+            cluster_name = int(match.group(1))
+            self.cluster_models.setdefault(cluster_name, []).append(model_f)
+
+    def sort_models(self):
+        # sorted by name, as they are listed in the model groups
+        for model_list in self.cluster_models.values():
+            model_list.sort()
+        self.cluster_models = dict(sorted(self.cluster_models.items()))
+
+    def get_problems(self):
+        """Get what keeps the run from being converted, nothing if it is complete."""
+        problem_list = []
+        for name, (subdir, fname) in RUN_INPUTS.items():
+            input_f = Path(subdir, fname)
+            if getattr(self, name) is None:
+                problem_list.append(f"{input_f} not found")
+            elif not self.size_dic[name] and name not in MAY_BE_EMPTY:
+                problem_list.append(f"{input_f} is empty")
+        if not self.cluster_models:
+            problem_list.append("no clusterN_M.pdb models found")
+        return problem_list
+
+    def check(self):
+        """Raise an error listing the problems of the run, if any."""
+        problem_list = self.get_problems()
+        if problem_list:
+            raise FileNotFoundError(
+                f"Incomplete run directory {self.rundir}: " + ", ".join(problem_list)
+            )
+
+    def summary(self):
+        """Describe the inputs found, one line each."""
+        line_list = [
+            f"{name}: {getattr(self, name)}"
+            for name in RUN_INPUTS
+            if getattr(self, name) is not None
+        ]
+        n_models = sum(len(model_list) for model_list in self.cluster_models.values())
+        line_list.append(f"models: {n_models} in {len(self.cluster_models)} clusters")
+        return line_list
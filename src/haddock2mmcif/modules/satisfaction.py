@@ -0,0 +1,245 @@
+import logging
+
+import ihm.dumper
+import ihm.restraint
+import numpy as np
+
+satlog = logging.getLogger("log")
+
+# Number of atom pairs whose distances are computed at once, bounds the
+#  memory of the temporary arrays
+CHUNK_SIZE = 1 << 22
+
+
+def expand_ranges(starts, counts):
+    """Concatenate the ranges `start, ..., start + count - 1`, without a loop."""
+    offsets = np.cumsum(counts) - counts
+    return np.repeat(starts - offsets, counts) + np.arange(counts.sum())
+
+
+def get_bounds(distance):
+    """Get the lower and upper limits of a distance restraint, NaN if unbound."""
+    if hasattr(distance, "distance_lower_limit"):
+        return distance.distance_lower_limit, distance.distance_upper_limit
+    if isinstance(distance, ihm.restraint.LowerBoundDistanceRestraint):
+        return distance.distance, np.nan
+    if isinstance(distance, ihm.restraint.UpperBoundDistanceRestraint):
+        return np.nan, distance.distance
+    return distance.distance, distance.distance
+
+
+class RestraintEvaluator:
+    # ======================================================================
+    # IMPORTANT #
+    # The distance of a restraint is the effective distance between the atoms
+    #  of its two features, `(sum r^-6) ^ (-1/6)` over all the pairs of atoms,
+    #  as HADDOCK computes it for the ambiguous restraints. A residue feature
+    #  stands for all the atoms of its residues, an atom feature (unambiguous
+    #  restraints between named atoms) only for its atoms. The pairs of all
+    #  the restraints are flattened into two arrays of atom indices, with the
+    #  index of their restraint, so a model is evaluated with a handful of
+    #  array operations. The pairs only depend on the atoms of the models,
+    #  which are the same for all the models of a run, so they are computed
+    #  once and reused as long as the topology does not change.
+    # ======================================================================
+    def __init__(self, restraint_list, asym_dic):
+        self.restraint_list = restraint_list
+        segid_dic = {asym: segid for segid, asym in asym_dic.items()}
+
+        bounds = [get_bounds(restraint.distance) for restraint in restraint_list]
+        self.lower = np.array([lower for lower, _ in bounds], dtype=np.float64)
+        self.upper = np.array([upper for _, upper in bounds], dtype=np.float64)
+
+        # the (segid, seq_id, atom name) of each side, flattened in restraint
+        #  order, the name is `None` for all the atoms of the residue
+        self.sides = []
+        for attr in ("feature1", "feature2"):
+            residue_list = []
+            residue_counts = []
+            for restraint in restraint_list:
+                residues = self.get_residues(getattr(restraint, attr), segid_dic)
+                residue_list.extend(residues)
+                residue_counts.append(len(residues))
+            self.sides.append((residue_list, np.array(residue_counts, dtype=np.int64)))
+
+        self._topology = None
+        self._pairs = None
+
+    @staticmethod
+    def get_residues(feature, segid_dic):
+        """Get the (segid, seq_id, atom name) of a residue or atom feature."""
+        if isinstance(feature, ihm.restraint.AtomFeature):
+            return [
+                (segid_dic[atom.residue.asym], atom.residue.seq_id, atom.id)
+                for atom in feature.atoms
+            ]
+
+        residues = []
+        for rng in feature.ranges:
+            asym = getattr(rng, "asym", rng)
+            start, end = rng.seq_id_range
+            segid = segid_dic[asym]
+            residues.extend((segid, seq_id, None) for seq_id in range(start, end + 1))
+        return residues
+
+    @staticmethod
+    def get_side_atoms(side, pdb, residue_keys, atom_order, atom_starts, atom_counts):
+        """Get the atoms of one side of each restraint, and their number."""
+        residue_list, residue_counts = side
+        chain_dic = {chain: code for code, chain in enumerate(pdb.chain_table)}
+        atom_id_dic = {atom_id: code for code, atom_id in enumerate(pdb.atom_id_table)}
+
+        # residues that are not in the model have no atoms
+        keys = np.array(
+            [
+                (chain_dic[segid] << 32) + seq_id if segid in chain_dic else -1
+                for segid, seq_id, _ in residue_list
+            ],
+            dtype=np.int64,
+        )
+        idx = np.searchsorted(residue_keys, keys)
+        idx = np.minimum(idx, len(residue_keys) - 1)
+        found = residue_keys[idx] == keys
+        counts = np.where(found, atom_counts[idx], 0)
+
+        atoms = atom_order[expand_ranges(atom_starts[idx], counts)]
+        atom_residue = np.repeat(np.arange(len(residue_list)), counts)
+
+        # a named atom only keeps the atom of its residue with that name, -1
+        #  keeps all of them and -2 none, the name is not in the model
+        names = np.array(
+            [
+                -1 if name is None else atom_id_dic.get(name, -2)
+                for _, _, name in residue_list
+            ],
+            dtype=np.int64,
+        )
+        atom_names = names[atom_residue]
+        keep = (atom_names == -1) | (pdb.atom_id_codes[atoms] == atom_names)
+        atoms, atom_residue = atoms[keep], atom_residue[keep]
+
+        residue_restraint = np.repeat(np.arange(len(residue_counts)), residue_counts)
+        n_atoms = np.bincount(
+            residue_restraint[atom_residue], minlength=len(residue_counts)
+        ).astype(np.int64)
+        return atoms, n_atoms
+
+    def get_pairs(self, pdb):
+        """Get the atom pairs of all the restraints, and the restraint of each pair."""
+        topology = (
+            tuple(pdb.chain_table),
+            tuple(pdb.atom_id_table),
+            pdb.chain_codes.tobytes(),
+            pdb.seq_ids.tobytes(),
+            pdb.atom_id_codes.tobytes(),
+        )
+        if topology == self._topology:
+            return self._pairs
+
+        # the atoms grouped by residue, each residue is a (start, count) of them
+        atom_keys = (pdb.chain_codes.astype(np.int64) << 32) + pdb.seq_ids
+        atom_order = np.argsort(atom_keys, kind="stable")
+        residue_keys, atom_starts, atom_counts = np.unique(
+            atom_keys[atom_order], return_index=True, return_counts=True
+        )
+
+        (atoms_i, n_i), (atoms_j, n_j) = [
+            self.get_side_atoms(
+                side, pdb, residue_keys, atom_order, atom_starts, atom_counts
+            )
+            for side in self.sides
+        ]
+
+        # every atom of one side is paired with every atom of the other side
+        n_pairs = n_i * n_j
+        restraint_idx = np.repeat(np.arange(len(n_pairs)), n_pairs)
+        pair_starts = np.cumsum(n_pairs) - n_pairs
+        local = np.arange(n_pairs.sum()) - pair_starts[restraint_idx]
+        offset_i = (np.cumsum(n_i) - n_i)[restraint_idx]
+        offset_j = (np.cumsum(n_j) - n_j)[restraint_idx]
+        pair_i = atoms_i[offset_i + local // n_j[restraint_idx]]
+        pair_j = atoms_j[offset_j + local % n_j[restraint_idx]]
+
+        self._topology = topology
+        self._pairs = (pair_i, pair_j, restraint_idx, n_pairs)
+        return self._pairs
+
+    def evaluate(self, pdb):
+        """Get the distance of each restraint in a loaded model, NaN if undefined."""
+        pair_i, pair_j, restraint_idx, n_pairs = self.get_pairs(pdb)
+
+        total = np.zeros(len(self.restraint_list), dtype=np.float64)
+        for start in range(0, len(pair_i), CHUNK_SIZE):
+            chunk = slice(start, start + CHUNK_SIZE)
+            diff = pdb.coords[pair_i[chunk]] - pdb.coords[pair_j[chunk]]
+            dist2 = np.einsum("ij,ij->i", diff, diff).astype(np.float64)
+            with np.errstate(divide="ignore"):
+                total += np.bincount(
+                    restraint_idx[chunk],
+                    weights=1.0 / dist2**3,
+                    minlength=len(total),
+                )
+
+        with np.errstate(divide="ignore"):
+            distances = total ** (-1 / 6)
+        distances[n_pairs == 0] = np.nan
+        return distances
+
+    def is_satisfied(self, distances):
+        """Check the distances against the bounds of their restraints."""
+        # NaN bounds are not checked, NaN distances are never satisfied
+        above = np.isnan(self.lower) | (distances >= self.lower)
+        below = np.isnan(self.upper) | (distances <= self.upper)
+        return above & below & ~np.isnan(distances)
+
+    def evaluate_model(self, model):
+        """Evaluate the restraints on a model, reading its atoms if needed."""
+        pdb = model.pdb
+        stream = not pdb.is_loaded
+        if stream:
+            pdb.load()
+
+        try:
+            distances = self.evaluate(pdb)
+        finally:
+            if stream:
+                pdb.unload()
+
+        satisfied = self.is_satisfied(distances)
+        model.restraint_fit = (self.restraint_list, distances, satisfied)
+        satlog.info(
+            f"{pdb.pdb_file.name}: {int(satisfied.sum())} of {len(satisfied)} "
+            "restraints satisfied"
+        )
+        return distances, satisfied
+
+
+class RestraintFitDumper(ihm.dumper.Dumper):
+    """Write the distance of each restraint in each model, and if it is satisfied.
+
+    `ihm` has no per-model fit for the derived distance restraints, so it is
+    written to a category of its own.
+    """
+
+    def dump(self, system, writer):
+        ordinal = 1
+        with writer.loop(
+            "_haddock_restraint_fit",
+            ["id", "restraint_id", "model_id", "distance", "satisfied"],
+        ) as lp:
+            for _, model in system._all_models():
+                restraint_fit = getattr(model, "restraint_fit", None)
+                if restraint_fit is None:
+                    continue
+                restraint_list, distances, satisfied = restraint_fit
+                for restraint, distance, is_satisfied in zip(
+                    restraint_list, distances.tolist(), satisfied.tolist()
+                ):
+                    lp.write(
+                        id=ordinal,
+                        restraint_id=restraint._id,
+                        model_id=model._id,
+                        distance=None if np.isnan(distance) else distance,
+                        satisfied="YES" if is_satisfied else "NO",
+                    )
+                    ordinal += 1
@@ -0,0 +1,219 @@
+import copy
+import itertools
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import ihm.dumper
+import ihm.model
+
+from haddock2mmcif.modules.output import open_output
+from haddock2mmcif.modules.satisfaction import RestraintFitDumper
+
+shardlog = logging.getLogger("log")
+
+# Rows of the atoms of a shard written at once when they are merged, the
+#  shards are read line by line so only a chunk of them is in memory
+CHUNK_SIZE = 1 << 14
+
+# The versions of ihm the atoms of the shards were checked to be spliced
+#  into, see benchmarks/bench_shards.py, as setup.py pins it
+IHM_VERSIONS = ((0, 35),)
+
+# Columns of the rows written by ihm, a longer row continues on the next line
+LINE_LENGTH = 80
+
+
+def can_splice_atoms():
+    """Check if the atoms of the shards can be spliced into the output of ihm.
+
+    The splicing relies on how ihm writes the atoms, which is only known for
+    the versions it was checked with.
+    """
+    version = tuple(int(part) for part in ihm.__version__.split(".")[:2])
+    return version in IHM_VERSIONS and hasattr(ihm.dumper._ModelDumper, "dump_atoms")
+
+
+def make_shard(system, model_group):
+    """Get a system with a single model group, sharing everything else."""
+    shard = copy.copy(system)
+    shard.state_groups = [ihm.model.StateGroup([ihm.model.State([model_group])])]
+    return shard
+
+
+def write_shard(system, shard_f):
+    """Write a shard as a standalone mmCIF."""
+    shardlog.info(f"Writing shard {shard_f}")
+    with open_output(shard_f) as fh:
+        ihm.dumper.write(fh, [system], dumpers=[RestraintFitDumper])
+    return shard_f
+
+
+def write_shards(system, shard_dir, jobs=1):
+    """Write each model group (cluster) of the system to its own mmCIF.
+
+    The shards are named after the ranking of their cluster, `rank_1.cif`...
+    """
+    shard_dir = Path(shard_dir)
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    shard_systems = [
+        make_shard(system, model_group) for model_group in system._all_model_groups()
+    ]
+    shard_list = [
+        Path(shard_dir, f"rank_{rank}.cif") for rank in range(1, len(shard_systems) + 1)
+    ]
+
+    # each shard is dumped in a single process, `map` keeps the order
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            list(executor.map(write_shard, shard_systems, shard_list))
+    else:
+        list(map(write_shard, shard_systems, shard_list))
+
+    return shard_list
+
+
+def read_loop(lines, category):
+    """Find the loop of a category in the lines of an mmCIF written by ihm.
+
+    Returns its keys and an iterator over its rows, which reads the lines of
+    the loop as it goes, nothing if there is no such loop.
+    """
+    keys = []
+    previous = None
+    for line in lines:
+        if line.startswith(f"{category}.") and (keys or previous == "loop_\n"):
+            keys.append(line[len(category) + 1 :].rstrip("\n"))
+        elif keys:
+            return keys, iter_rows(itertools.chain([line], lines), len(keys))
+        previous = line
+    return [], iter(())
+
+
+def iter_rows(lines, n_keys):
+    """Iterate over the rows of a loop, as lists of values.
+
+    The lines are read up to the end of the loop, a line holding a single
+    `#`. The values are split on whitespace, which holds for the atoms, their
+    values are never quoted strings with spaces.
+    """
+    values = []
+    for line in lines:
+        if line.strip() == "#":
+            break
+        row = line.split()
+        if not values and len(row) == n_keys:
+            # most rows fit in a line
+            yield row
+            continue
+        values.extend(row)
+        while len(values) >= n_keys:
+            yield values[:n_keys]
+            values = values[n_keys:]
+
+    if values:
+        raise ValueError("The rows of the loop have missing values")
+
+
+def format_row(values):
+    """Format the values of a row as ihm does, wrapping the long rows."""
+    line = " ".join(values)
+    if len(line) <= LINE_LENGTH:
+        return line
+
+    line_list = [values[0]]
+    for value in values[1:]:
+        if len(line_list[-1]) + len(value) + 1 > LINE_LENGTH:
+            line_list.append(value)
+        else:
+            line_list[-1] += " " + value
+    return "\n".join(line_list)
+
+
+class AtomSpliceDumper(ihm.dumper._ModelDumper):
+    # ======================================================================
+    # IMPORTANT #
+    # The merged output is dumped by ihm from the whole system, so all its
+    #  IDs are consistent, except for the atoms, which are the bulk of it.
+    # Those are copied from the shards, already formatted, and only their
+    #  ordinal and model IDs are renumbered, the models of each shard are
+    #  numbered from 1 in the same order as in its model group.
+    # ======================================================================
+    def __init__(self, shard_list):
+        super().__init__()
+        self.shard_list = shard_list
+
+    def dump_atoms(self, system, writer, add_ihm=True):
+        seen_types = {}
+        first_id = 1
+        loop_keys = None
+        for model_group, shard_f in zip(system._all_model_groups(), self.shard_list):
+            shardlog.info(f"Merging shard {shard_f}")
+            model_ids = [
+                str(i) for i in dict.fromkeys(model._id for model in model_group)
+            ]
+            with open(shard_f, "r", encoding="utf-8") as fh:
+                keys, rows = read_loop(fh, "_atom_site")
+                if not keys:
+                    continue
+                if loop_keys is None:
+                    writer.fh.write("#\nloop_\n")
+                    writer.fh.write("".join(f"_atom_site.{key}\n" for key in keys))
+                    loop_keys = keys
+                elif keys != loop_keys:
+                    raise ValueError(f"The atoms of {shard_f} differ from the others")
+
+                id_col = keys.index("id")
+                type_col = keys.index("type_symbol")
+                model_cols = [
+                    keys.index(key)
+                    for key in ("pdbx_PDB_model_num", "ihm_model_id")
+                    if key in keys
+                ]
+                line_list = []
+                for ordinal, values in enumerate(rows, first_id):
+                    values[id_col] = str(ordinal)
+                    for col in model_cols:
+                        values[col] = model_ids[int(values[col]) - 1]
+                    # the `_atom_type` are the elements of the atoms, as ihm lists them
+                    seen_types[values[type_col]] = None
+                    line_list.append(format_row(values))
+                    if len(line_list) == CHUNK_SIZE:
+                        writer.fh.write("\n".join(line_list) + "\n")
+                        line_list = []
+                    first_id = ordinal + 1
+                if line_list:
+                    writer.fh.write("\n".join(line_list) + "\n")
+
+        if loop_keys is not None:
+            writer.fh.write("#\n")
+        return seen_types
+
+
+class MergeVariant(ihm.dumper.IHMVariant):
+    """The usual output, except for the atoms, which are copied from the shards."""
+
+    def __init__(self, shard_list):
+        self.shard_list = shard_list
+
+    def get_dumpers(self):
+        dumper_list = [
+            AtomSpliceDumper(self.shard_list)
+            if type(dumper) is ihm.dumper._ModelDumper
+            else dumper
+            for dumper in super().get_dumpers()
+        ]
+        if not any(isinstance(dumper, AtomSpliceDumper) for dumper in dumper_list):
+            raise ValueError("ihm has no dumper of the atoms to splice the shards in")
+        return dumper_list
+
+
+def merge_shards(system, shard_list, output_fname, compression=None):
+    """Merge the shards of the model groups of a system into a single mmCIF."""
+    with open_output(output_fname, "mmCIF", compression) as fh:
+        ihm.dumper.write(
+            fh,
+            [system],
+            variant=MergeVariant(shard_list),
+            dumpers=[RestraintFitDumper],
+        )
@@ -1,3 +1,10 @@
-def backmap(dict, value):
-    """Find a key in a dictionary by its value."""
-    return list(dict.keys())[list(dict.values()).index(value)]
+import hashlib
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """Get the sha256 hex digest of the contents of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()